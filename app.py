@@ -1,13 +1,15 @@
 import streamlit as st
-import google.generativeai as genai
 import os
-import json
 import uuid
-from datetime import datetime
-from PIL import Image
 from pathlib import Path
-# Se asume que character_base.py (CharacterAI) existe y está correcto.
-from character_base import CharacterAI 
+from chat_engine import ChatEngine
+from conversation_manager import ConversationManager
+from chat_store import ChatStore
+from persistence import WriteBehindQueue
+from avatars import AvatarCache
+from character_registry import CharacterRegistry
+from response_cache import create_response_cache
+from metrics import get_metrics
 
 # --- Configuración y Estilos Críticos ---
 st.set_page_config(
@@ -16,57 +18,136 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded"
 )
-def load_css(file_name):
-    """Lee el archivo CSS y lo inyecta en la aplicación usando st.markdown."""
+@st.cache_resource
+def read_css(file_name):
+    """Contenido del archivo CSS, leído de disco una sola vez por proceso (None si no existe)."""
     try:
-        # Abrir y leer el contenido completo del archivo CSS
-        with open(file_name) as f:
-            st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+        return Path(file_name).read_text(encoding="utf-8")
     except FileNotFoundError:
+        return None
+
+def load_css(file_name):
+    """Inyecta el CSS en la aplicación usando st.markdown (hay que emitirlo en cada rerun)."""
+    css = read_css(file_name)
+    if css is None:
         # Mensaje de advertencia si el archivo no existe
         st.warning(f"⚠️ Archivo CSS '{file_name}' no encontrado. Usando estilos por defecto.")
+    else:
+        st.markdown(f'<style>{css}</style>', unsafe_allow_html=True)
 
 load_css("styles.css")
+
+@st.cache_resource
+def setup_folders(*folders):
+    """Crea las carpetas de trabajo una sola vez por proceso."""
+    for folder in folders:
+        Path(folder).mkdir(exist_ok=True)
+
+@st.cache_resource
+def get_conversation_manager():
+    """Gestor de conversaciones compartido por todas las sesiones del proceso."""
+    return ConversationManager()
+
+@st.cache_resource
+def get_chat_store(chats_folder):
+    """Almacén SQLite compartido; importa una única vez los chats JSON antiguos."""
+    Path(chats_folder).mkdir(exist_ok=True)
+    store = ChatStore(Path(chats_folder) / ChatStore.DB_NAME)
+    store.migrate_json_folder(chats_folder)
+    return store
+
+@st.cache_resource
+def get_chat_writer(chats_folder):
+    """Cola de escritura diferida sobre el almacén compartido."""
+    return WriteBehindQueue(get_chat_store(chats_folder), metrics=get_metrics())
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_chat_page(chats_folder, store_version, search, page, page_size):
+    """Índice de metadatos de una página de chats; store_version invalida la caché."""
+    store = get_chat_store(chats_folder)
+    total = store.count_chats(search)
+    return store.list_chats(limit=page_size, offset=page * page_size, search=search), total
+
+@st.cache_resource
+def get_avatar_cache(images_folder):
+    """Miniaturas y listado de imágenes compartidos por todo el proceso."""
+    return AvatarCache(images_folder)
+
+@st.cache_resource
+def get_character_registry(characters_folder, images_folder):
+    """Personajes guardados, indexados una sola vez por proceso con miniaturas precalculadas."""
+    Path(characters_folder).mkdir(exist_ok=True)
+    return CharacterRegistry(characters_folder, avatars=get_avatar_cache(images_folder))
+
+@st.cache_resource
+def get_response_cache(chats_folder):
+    """Caché de respuestas compartida; RESPONSE_CACHE_BACKEND=disk la persiste en SQLite."""
+    return create_response_cache(chats_folder)
+
+@st.cache_resource
+def get_chat_engine(chats_folder, characters_folder, images_folder):
+    """Lógica de chats (la misma que usa headless.py) sobre los recursos compartidos del proceso."""
+    return ChatEngine(
+        get_conversation_manager(), get_chat_store(chats_folder), get_chat_writer(chats_folder),
+        registry=get_character_registry(characters_folder, images_folder),
+        response_cache=get_response_cache(chats_folder),
+        retrieval_folder=Path(chats_folder) / "retrieval",  # Índices de recuperación por chat
+    )
+
 class CharacterCreatorApp:
     IMAGES_FOLDER = "character_images"
     CHATS_FOLDER = "saved_chats"
     CHARACTERS_FOLDER = "characters"
+    CHATBOTS_PAGE_SIZE = 10
+    CHAT_WINDOW = 30  # Mensajes visibles al abrir un chat; "cargar anteriores" añade otros tantos
     
     def __init__(self):
         self._setup_folders()
+        self.manager = get_conversation_manager()
+        self.store = get_chat_store(self.CHATS_FOLDER)
+        self.writer = get_chat_writer(self.CHATS_FOLDER)
+        self.avatars = get_avatar_cache(self.IMAGES_FOLDER)
+        self.registry = get_character_registry(self.CHARACTERS_FOLDER, self.IMAGES_FOLDER)
+        self.response_cache = get_response_cache(self.CHATS_FOLDER)
+        self.engine = get_chat_engine(self.CHATS_FOLDER, self.CHARACTERS_FOLDER, self.IMAGES_FOLDER)
+        self.metrics = get_metrics()
         self.initialize_session_state()
+        self.restore_session()
 
     # ===================== Setup y Utilidades =====================
     def _setup_folders(self):
-        Path(self.IMAGES_FOLDER).mkdir(exist_ok=True)
-        Path(self.CHATS_FOLDER).mkdir(exist_ok=True)
-        Path(self.CHARACTERS_FOLDER).mkdir(exist_ok=True)
+        setup_folders(self.IMAGES_FOLDER, self.CHATS_FOLDER, self.CHARACTERS_FOLDER)
 
     def get_available_images(self):
-        return sorted([str(p) for p in Path(self.IMAGES_FOLDER).glob("*") 
-                       if p.suffix.lower() in ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp']])
+        # Listado cacheado por mtime de la carpeta y sin duplicados por contenido
+        return self.avatars.list_images()
+
+    def avatar(self, image_path, width=80):
+        """Miniatura para los avatares de los mensajes (None si no hay imagen)."""
+        return self.avatars.thumbnail(image_path, width)
 
     def initialize_session_state(self):
+        # Solo identificadores: personajes e historiales viven en el gestor compartido
         defaults = {
-            "current_character": None, "messages": [],
-            "character_instance": None, "creator_mode": True,
-            "selected_image": None, "active_menu": "home"
+            "active_chat": None, "creator_mode": True,
+            "selected_image": None, "active_menu": "home",
+            "open_chats": [],  # unique_id de los chats abiertos en esta sesión
+            "chatbots_page": 0
         }
         for key, value in defaults.items():
             if key not in st.session_state:
                 st.session_state[key] = value
                 
-        # Configurar la API Key aquí (se asume que CharacterAI lo usa)
-        if 'GOOGLE_API_KEY' in os.environ:
-             genai.configure(api_key=os.environ['GOOGLE_API_KEY'])
-        elif 'api_configured' not in st.session_state:
+        # La API se configura una sola vez por proceso, al crear el primer modelo (model_client)
+        if 'GOOGLE_API_KEY' not in os.environ and 'api_configured' not in st.session_state:
              st.warning("⚠️ La variable de entorno 'GOOGLE_API_KEY' no está configurada.")
              st.session_state.api_configured = False
 
 
     def display_image(self, image_path, width=100):
-        if image_path and Path(image_path).exists():
-            st.image(Image.open(image_path), width=width)
+        thumbnail = self.avatars.thumbnail(image_path, width)
+        if thumbnail:
+            st.image(thumbnail, width=width)
         else:
             st.warning("⚠ Imagen no encontrada")
 
@@ -77,107 +158,117 @@ class CharacterCreatorApp:
     # ===================== Lógica de Personaje/Chat =====================
     def create_character(self, name, personality, greeting, profile_image_path): 
         try:
-            model_name = "gemini-2.0-flash" # Fijo
-            
-            st.session_state.character_instance = CharacterAI(
-                name=name, personality=personality, greeting=greeting, 
-                profile_image_path=profile_image_path, model_name=model_name
-            )
-            st.session_state.character_instance.unique_id = self.generate_unique_id()
-
-            st.session_state.current_character = name
-            st.session_state.messages = [{
-                "role": name, # Usar el nombre como role para identificarlo
-                "content": greeting,
-                "avatar_path": profile_image_path
-            }]
-            st.session_state.creator_mode = False
+            # Modelo fijo (ChatEngine.DEFAULT_MODEL)
+            character = self.engine.new_character(name, personality, greeting, profile_image_path)
+            self.start_chat(character)
             st.success(f"¡Personaje **{name}** creado exitosamente!")
             st.rerun()
 
         except Exception as e:
             st.error(f"Error al crear el personaje: {str(e)}")
 
+    def start_chat_from_template(self, character_id):
+        """Nuevo chat con un personaje guardado, sin volver a subir la imagen ni escribir la persona."""
+        try:
+            character = self.engine.from_template(character_id)
+            if character is None:
+                st.error(f"⚠️ No existe ningún personaje guardado con ID `{character_id}`.")
+                return
+            self.start_chat(character)
+            st.rerun()
+        except Exception as e:
+            st.error(f"Error al iniciar el chat: {str(e)}")
+
+    def start_chat(self, character):
+        """Abre un chat nuevo con el personaje, empezando por su saludo, y lo activa."""
+        # Persistencia automática desde el primer mensaje
+        unique_id = self.engine.start_chat(character)
+        self.switch_chat(unique_id)
+        return unique_id
+
+    def switch_chat(self, unique_id):
+        """Activa un chat abierto sin reconstruir su instancia de CharacterAI."""
+        st.session_state.active_chat = unique_id
+        if unique_id not in st.session_state.open_chats:
+            st.session_state.open_chats.append(unique_id)
+        st.session_state.creator_mode = False
+        # El ID en la URL permite restaurar el chat al refrescar la página
+        st.query_params["chat"] = unique_id
+
+    def restore_session(self):
+        """Recarga el chat activo indicado en la URL tras un refresco del navegador."""
+        unique_id = st.query_params.get("chat")
+        if not unique_id or st.session_state.active_chat:
+            return
+        try:
+            if not self.open_chat(unique_id):
+                del st.query_params["chat"]
+        except Exception as e:
+            st.error(f"❌ Error restaurando el chat: {e}")
+
     def save_character_and_chat(self, character_instance, is_chat=True):
-        """Guarda tanto el personaje (base) como el chat (completo)."""
-        folder = self.CHATS_FOLDER if is_chat else self.CHARACTERS_FOLDER
-        
+        """Guarda el personaje base en el registro (JSON atómico) o fuerza el guardado completo del chat."""
         if not character_instance:
             st.warning("⚠️ No hay datos para guardar.")
             return
 
         unique_id = getattr(character_instance, 'unique_id', self.generate_unique_id())
         setattr(character_instance, 'unique_id', unique_id) # Asegurar que el ID esté en la instancia
-
-        data = {
-            "name": character_instance.name, "personality": character_instance.personality,
-            "greeting": character_instance.greeting, "profile_image_path": character_instance.profile_image_path,
-            "model_name": character_instance.model_name, "unique_id": unique_id,
-        }
-        if is_chat:
-            data["messages"] = st.session_state.messages
-
-        filepath = Path(folder) / f"{unique_id}.json" # Usar ID como nombre de archivo para chats
+        data = self.engine.character_data(character_instance)
 
         try:
-            if is_chat and filepath.exists():
-                st.warning(f"⚠️ El chat con ID `{unique_id}` será sobrescrito.")
-            
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            if is_chat:
+                # Los chats ya se guardan solos; aquí se fuerza una copia completa y se espera a disco
+                self.engine.save(unique_id)
+            else:
+                # El chat pasa a referenciar al personaje guardado (misma fila en el almacén)
+                character_instance.character_id = self.registry.save(data).character_id
             
             st.success(f"💾 {'Chat' if is_chat else 'Personaje base'} guardado correctamente.")
 
         except Exception as e:
             st.error(f"⚠ Error al guardar: {e}")
 
-    def delete_chat(self, file_path):
-        """Elimina un archivo de chat del sistema."""
+    def delete_chat(self, unique_id):
+        """Elimina un chat (y sus mensajes) del almacén."""
         try:
-            Path(file_path).unlink()
+            # También cierra la sesión viva si el chat estaba abierto
+            self.engine.delete(unique_id)
+            if unique_id in st.session_state.open_chats:
+                st.session_state.open_chats.remove(unique_id)
+            if st.session_state.active_chat == unique_id:
+                st.session_state.update({"active_chat": None, "creator_mode": True})
+                st.query_params.pop("chat", None)
             st.success(f"🗑️ Chat eliminado exitosamente.")
             st.rerun()
         except Exception as e:
             st.error(f"❌ Error al eliminar chat: {e}")
 
-    def load_chat_history(self, selected_file):
+    def open_chat(self, unique_id):
+        """Abre un chat guardado (o reutiliza su sesión viva). Devuelve False si no existe."""
+        if self.engine.get(unique_id) is None:
+            return False
+        self.switch_chat(unique_id)
+        return True
+
+    def active_character(self):
+        """CharacterAI del chat activo; si el gestor lo descartó (LRU) se rehidrata desde el almacén."""
+        unique_id = st.session_state.active_chat
+        if unique_id is None:
+            return None
+        return self.engine.get(unique_id)
+
+    def load_chat_history(self, unique_id):
             try:
-                # Leer el archivo JSON
-                with open(selected_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-
-                # Validar campos mínimos requeridos
-                required_keys = ["name", "personality", "greeting", "messages"]
-                if not all(k in data for k in required_keys):
-                    st.error("⚠️ El archivo no contiene la información mínima requerida (nombre, personalidad, saludo, mensajes).")
+                if not self.open_chat(unique_id):
+                    st.error(f"⚠️ No existe ningún chat con ID `{unique_id}`.")
                     return
 
-                # Cargar datos con valores por defecto
-                model_name = data.get("model_name", "gemini-2.0-flash")
-                unique_id = data.get("unique_id", Path(selected_file).stem)
-                profile_image_path = data.get("profile_image_path", None)
-
-                # Crear instancia del personaje
-                st.session_state.character_instance = CharacterAI(
-                    name=data["name"],
-                    personality=data["personality"],
-                    greeting=data["greeting"],
-                    profile_image_path=profile_image_path,
-                    model_name=model_name
-                )
-                st.session_state.character_instance.unique_id = unique_id
-                st.session_state.current_character = data["name"]
-                st.session_state.messages = data["messages"]
-
-                # Configurar modo y menú
-                st.session_state.creator_mode = False
                 st.session_state.active_menu = "home"  # Ir al menú principal antes del rerun
-
-                # Limpiar historial del modelo (se recrea desde messages)
-                st.session_state.character_instance.clear_history()
+                character = self.manager.get(unique_id)
 
                 # Mensaje de éxito
-                st.success(f"✅ Chat cargado correctamente.\nID: {unique_id}\nModelo: {model_name}")
+                st.success(f"✅ Chat cargado correctamente.\nID: {unique_id}\nModelo: {character.model_name}")
 
                 # Rerun de la app
                 st.rerun()
@@ -186,6 +277,22 @@ class CharacterCreatorApp:
                 st.error(f"❌ Error cargando chat: {e}")
     # ===================== Renderizado de Vistas =====================
     def render_character_creator(self, available_images):
+        templates = self.registry.list()
+        if templates:
+            st.subheader("📚 Personajes guardados")
+            col_image, col_select, col_button = st.columns([1, 3, 1])
+            with col_select:
+                character_id = st.selectbox(
+                    "Empieza un chat nuevo con:", options=[t.character_id for t in templates],
+                    format_func=lambda cid: self.registry.get(cid).name, key="template_selector"
+                )
+            with col_image:
+                self.display_image(self.registry.get(character_id).profile_image_path, width=80)
+            with col_button:
+                if st.button("💬 Nuevo chat", key="start_from_template", use_container_width=True):
+                    self.start_chat_from_template(character_id)
+            st.markdown("---")
+
         st.subheader("🧠 Crear Personaje")
 
         if st.session_state.selected_image:
@@ -213,16 +320,11 @@ class CharacterCreatorApp:
         with tab2:
             uploaded_file = st.file_uploader("Sube una imagen:", type=['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'])
             if uploaded_file:
-                st.image(Image.open(uploaded_file), width=180, caption="Vista previa")
+                st.image(uploaded_file, width=180, caption="Vista previa")
                 if st.button("💾 Guardar y usar esta imagen", key="save_uploaded_image"):
                     try:
-                        file_path = Path(self.IMAGES_FOLDER) / uploaded_file.name
-                        if file_path.exists(): # Evitar sobrescribir
-                            name, ext = file_path.stem, file_path.suffix
-                            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                            file_path = Path(self.IMAGES_FOLDER) / f"{name}_{timestamp}{ext}"
-
-                        Image.open(uploaded_file).save(file_path)
+                        # Guarda la imagen y genera sus miniaturas (reutiliza la existente si es idéntica)
+                        file_path = Path(self.avatars.save_upload(uploaded_file))
                         st.session_state.selected_image = str(file_path)
                         st.success(f"✅ Imagen guardada: {file_path.name}")
                         st.rerun()
@@ -245,7 +347,7 @@ class CharacterCreatorApp:
 
     def render_chat_interface(self):
             """Renderiza la interfaz de chat con el personaje activo."""
-            character = st.session_state.character_instance
+            character = self.active_character()
             
             if not character:
                 st.warning("⚠️ No hay personaje activo")
@@ -258,65 +360,108 @@ class CharacterCreatorApp:
             with col2:
                 st.title(f"💬 Chat con {character.name}")
                 st.caption(f"**Personalidad:** {character.personality[:100]}...")
+                character.cache_enabled = st.toggle(
+                    "⚡ Reutilizar respuestas repetidas", value=character.cache_enabled,
+                    key=f"cache_enabled_{character.unique_id}"
+                )
             with col3:
                 if st.button("💾 Guardar Chat", use_container_width=True):
                     self.save_character_and_chat(character, is_chat=True)
+                if st.button("📚 Guardar personaje", use_container_width=True):
+                    self.save_character_and_chat(character, is_chat=False)
                 if st.button("🔄 Nuevo Chat", use_container_width=True):
-                    st.session_state.update({
-                        "creator_mode": True, 
-                        "messages": [], 
-                        "character_instance": None, 
-                        "current_character": None
-                    })
+                    st.session_state.update({"creator_mode": True, "active_chat": None})
+                    st.query_params.pop("chat", None)
                     st.rerun()
             
-            st.markdown("---")
+            # Selector de chats abiertos (se mantienen vivos en el gestor)
+            open_ids = [uid for uid in st.session_state.open_chats if uid in self.manager]
+            if len(open_ids) > 1:
+                selected_id = st.selectbox(
+                    "Chats abiertos:", options=open_ids,
+                    index=open_ids.index(character.unique_id),
+                    format_func=lambda uid: f"{self.manager.get(uid).name} ({uid[:8]})",
+                    key="open_chat_selector"
+                )
+                if selected_id != character.unique_id:
+                    self.switch_chat(selected_id)
+                    st.rerun()
             
-            # Mostrar mensajes
-            for msg in st.session_state.messages:
-                with st.chat_message(msg["role"], avatar=msg.get("avatar_path")):
-                    st.markdown(msg["content"])
+            st.markdown("---")
+            self.render_messages(character.unique_id)
+
+    @st.fragment
+    def render_messages(self, unique_id):
+        """Mensajes y entrada del chat; enviar un mensaje solo vuelve a ejecutar este fragmento.
+
+        Se muestran los últimos CHAT_WINDOW mensajes (ampliables con "cargar anteriores"),
+        así que el coste de cada rerun no crece con la longitud de la conversación.
+        """
+        # El fragmento se reejecuta sin el script completo: la instancia viva se busca en cada
+        # ejecución (el gestor pudo descartarla o rehidratarla desde la última)
+        character = self.engine.get(unique_id)
+        if character is None:
+            st.warning("⚠️ Este chat ya no existe.")
+            return
+        history = character.conversation_history
+        window_key = f"chat_window_{unique_id}"
+        visible = st.session_state.get(window_key, self.CHAT_WINDOW)
+        start = max(0, len(history) - visible)
+        if start:
+            # El callback amplía la ventana antes del rerun del fragmento que provoca el clic
+            st.button(
+                f"⬆️ Cargar mensajes anteriores ({start} más)",
+                key=f"load_older_{unique_id}", use_container_width=True,
+                on_click=lambda: st.session_state.update({window_key: visible + self.CHAT_WINDOW})
+            )
+
+        # El historial del personaje es la única copia de los mensajes
+        character_avatar = self.avatar(character.profile_image_path)
+        for msg in history[start:]:
+            if msg.role == "Usuario":
+                with st.chat_message("user"):
+                    st.markdown(msg.content)
+            else:
+                with st.chat_message(msg.role, avatar=character_avatar):
+                    st.markdown(msg.content)
+        
+        # Input del usuario
+        if user_input := st.chat_input("Escribe tu mensaje...", key="chat_input_main"):
+            with st.chat_message("user"):
+                st.markdown(user_input)
             
-            # Input del usuario
-            if user_input := st.chat_input("Escribe tu mensaje...", key="chat_input_main"):
-                # Agregar mensaje del usuario
-                st.session_state.messages.append({
-                    "role": "user",
-                    "content": user_input,
-                    "avatar_path": None
-                })
+            # Obtener respuesta del personaje en streaming; las burbujas ya quedan dibujadas
+            # y el siguiente rerun las leerá del historial, así que no hace falta st.rerun().
+            # El motor persiste el turno completo al terminar, aunque se interrumpa la lectura
+            try:
+                with st.chat_message(character.name, avatar=character_avatar):
+                    st.write_stream(self.engine.stream(unique_id, user_input))
                 
-                # Obtener respuesta del personaje
-                with st.spinner("Pensando..."):
-                    try:
-                        response = character.generate_response(user_input)
-                        
-                        # Guardar respuesta
-                        st.session_state.messages.append({
-                            "role": character.name,
-                            "content": response,
-                            "avatar_path": character.profile_image_path
-                        })
-                        
-                        # Rerun para actualizar la interfaz y limpiar el input
-                        st.rerun()
-                        
-                    except Exception as e:
-                        st.error(f"Error generando respuesta: {e}")
+            except Exception as e:
+                # El turno fallido no se guarda (CharacterAI ya lo retiró del historial)
+                st.error(f"Error generando respuesta: {e}")
    
     def render_chatbots_interface(self):
         st.title("🤖 Mis Chatbots")
-        chatbot_files = sorted(Path(self.CHATS_FOLDER).glob("*.json"))
+        search = st.text_input("🔍 Buscar por nombre:", key="chatbots_search").strip()
+        if search != st.session_state.get("chatbots_last_search", ""):
+            st.session_state.chatbots_last_search = search
+            st.session_state.chatbots_page = 0
+
+        # Solo se consulta la página visible; la caché se invalida con la versión del almacén
+        page_size = self.CHATBOTS_PAGE_SIZE
+        chat_summaries, total = get_chat_page(
+            self.CHATS_FOLDER, self.store.version(), search, st.session_state.chatbots_page, page_size
+        )
+        total_pages = max(1, -(-total // page_size))
+        if st.session_state.chatbots_page >= total_pages:
+            st.session_state.chatbots_page = total_pages - 1
+            st.rerun()
 
-        if chatbot_files:
-            for file_path in chatbot_files:
+        if chat_summaries:
+            for data in chat_summaries:
                 try:
-                    data = json.loads(file_path.read_text(encoding="utf-8"))
-                    
-                    if not all(k in data for k in ["name", "personality", "profile_image_path"]): 
-                        continue
-                    
-                    unique_id = data.get("unique_id", file_path.stem)
+                    unique_id = data["unique_id"]
                     
                     col1, col2, col3, col4 = st.columns([1, 3, 1, 1])
                     with col1: 
@@ -324,11 +469,11 @@ class CharacterCreatorApp:
                     with col2:
                         st.subheader(data["name"])
                         st.caption(f"**Personalidad:** {data['personality'][:100]}...")
-                        st.caption(f"Último chat: {len(data.get('messages', []))} mensajes")
+                        st.caption(f"Último chat: {data['message_count']} mensajes")
                     with col3:
                         if st.button(f"💬 Chatear", key=f"chat_{unique_id}", use_container_width=True):
                             # Cargar el chat
-                            self.load_chat_history(str(file_path))
+                            self.load_chat_history(unique_id)
                             # Cambiar al menú home para mostrar el chat
                             st.session_state.active_menu = "home"
                             # El rerun ya está en load_chat_history, pero aseguramos el cambio de menú
@@ -340,16 +485,16 @@ class CharacterCreatorApp:
                                 st.warning(f"⚠️ ¿Seguro que quieres eliminar a **{data['name']}**?")
                                 st.rerun()
                             else:
-                                self.delete_chat(str(file_path))
                                 del st.session_state[f"confirm_delete_{unique_id}"]
+                                self.delete_chat(unique_id)
                     
                     # Mostrar confirmación si existe
                     if st.session_state.get(f"confirm_delete_{unique_id}", False):
                         col_confirm1, col_confirm2 = st.columns(2)
                         with col_confirm1:
                             if st.button(f"✅ Sí, eliminar", key=f"yes_{unique_id}", use_container_width=True):
-                                self.delete_chat(str(file_path))
                                 del st.session_state[f"confirm_delete_{unique_id}"]
+                                self.delete_chat(unique_id)
                         with col_confirm2:
                             if st.button(f"❌ Cancelar", key=f"no_{unique_id}", use_container_width=True):
                                 del st.session_state[f"confirm_delete_{unique_id}"]
@@ -358,7 +503,22 @@ class CharacterCreatorApp:
                     st.markdown("---")
 
                 except Exception as e:
-                    st.error(f"❌ Error cargando chatbot desde {file_path.name}: {e}")
+                    st.error(f"❌ Error cargando chatbot {data.get('name', '')}: {e}")
+
+            # Paginación
+            col_prev, col_info, col_next = st.columns([1, 2, 1])
+            with col_prev:
+                if st.button("⬅️ Anterior", key="chatbots_prev", disabled=st.session_state.chatbots_page == 0, use_container_width=True):
+                    st.session_state.chatbots_page -= 1
+                    st.rerun()
+            with col_info:
+                st.caption(f"Página {st.session_state.chatbots_page + 1} de {total_pages} · {total} chats")
+            with col_next:
+                if st.button("Siguiente ➡️", key="chatbots_next", disabled=st.session_state.chatbots_page >= total_pages - 1, use_container_width=True):
+                    st.session_state.chatbots_page += 1
+                    st.rerun()
+        elif search:
+            st.info(f"Ningún chatbot coincide con '{search}'.")
         else:
             st.info("No tienes chatbots guardados. Crea y guarda un chat desde 'Home'.")
 
@@ -371,7 +531,8 @@ class CharacterCreatorApp:
             
             # Botones de navegación simplificados
             if st.button("🏠 Home", key="btn_home", use_container_width=True):
-                st.session_state.update({"active_menu": "home", "creator_mode": True, "messages": [], "character_instance": None, "current_character": None, "selected_image": None})
+                st.session_state.update({"active_menu": "home", "creator_mode": True, "active_chat": None, "selected_image": None})
+                st.query_params.pop("chat", None)
                 st.rerun()
 
             if st.button("🤖 Chatbots", key="btn_chatbots", use_container_width=True):
@@ -385,13 +546,40 @@ class CharacterCreatorApp:
                 st.title("🎭 Character AI Creator")
                 st.caption("Crea, personaliza y conversa con tus personajes de IA")
                 
-                if st.session_state.character_instance and not st.session_state.creator_mode:
-                    self.render_chat_interface()
+                if st.session_state.active_chat and not st.session_state.creator_mode:
+                    with self.metrics.timer("render_chat"):
+                        self.render_chat_interface()
                 else:
-                    self.render_character_creator(self.get_available_images())
+                    with self.metrics.timer("render_creator"):
+                        self.render_character_creator(self.get_available_images())
 
             elif menu == "chatbots":
-                 self.render_chatbots_interface()
+                with self.metrics.timer("render_chatbots"):
+                    self.render_chatbots_interface()
+
+        self.render_metrics_panel()
+
+    def render_metrics_panel(self):
+        """Panel de depuración opcional con las métricas del proceso en la barra lateral."""
+        if not st.sidebar.toggle("📊 Métricas de rendimiento", key="show_metrics"):
+            return
+        snapshot = self.metrics.snapshot()
+        with st.sidebar:
+            if self.metrics.last_turn:
+                st.caption("Último turno")
+                st.json(self.metrics.last_turn, expanded=False)
+            st.caption("Tiempos (ms)")
+            st.dataframe(
+                [{"métrica": name, **{k: round(v, 2) for k, v in t.items()}} for name, t in sorted(snapshot["timings"].items())],
+                hide_index=True, use_container_width=True
+            )
+            st.caption("Contadores")
+            st.dataframe(
+                [{"métrica": name, "valor": value} for name, value in sorted(snapshot["counters"].items())],
+                hide_index=True, use_container_width=True
+            )
+            if self.response_cache is not None:
+                st.caption(f"Caché de respuestas: {self.response_cache.stats()}")
 
 
 if __name__ == "__main__":
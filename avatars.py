@@ -0,0 +1,111 @@
+import hashlib
+import io
+import threading
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp'}
+THUMBNAIL_SIZES = (80, 100, 120, 180)  # Anchos usados por la interfaz (lista, cabecera, creador)
+
+
+@lru_cache(maxsize=1024)
+def _file_hash(path, mtime_ns, size):
+    """Hash del contenido; la clave (mtime, tamaño) evita releer archivos sin cambios."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def content_hash(path):
+    stat = Path(path).stat()
+    return _file_hash(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+class AvatarCache:
+    """Miniaturas WebP de los avatares con caché en disco (por hash de contenido) y en memoria."""
+    THUMBS_DIRNAME = ".thumbs"
+    WEBP_QUALITY = 80
+
+    def __init__(self, images_folder, sizes=THUMBNAIL_SIZES, max_memory_items=512):
+        self.images_folder = Path(images_folder)
+        self.thumbs_folder = self.images_folder / self.THUMBS_DIRNAME
+        self.thumbs_folder.mkdir(parents=True, exist_ok=True)
+        self.sizes = tuple(sorted(sizes))
+        self._listing_key = None
+        self._listing = []
+        self._lock = threading.Lock()
+        self._thumbnail_cached = lru_cache(maxsize=max_memory_items)(self._thumbnail_for)
+
+    # ===================== Miniaturas =====================
+    def _fit_size(self, width):
+        """Menor tamaño precalculado que cubre el ancho pedido (o el mayor disponible)."""
+        return next((s for s in self.sizes if s >= width), self.sizes[-1])
+
+    def _thumbnail_for(self, path, mtime_ns, file_size, size):
+        thumb_path = self.thumbs_folder / f"{_file_hash(path, mtime_ns, file_size)}_{size}.webp"
+        if not thumb_path.exists():
+            from PIL import Image  # Solo hace falta al generar miniaturas nuevas
+            with Image.open(path) as img:
+                img.seek(0)  # Primer fotograma en GIF animados
+                img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+                img.thumbnail((size, size))
+                tmp_path = thumb_path.with_name(f".{thumb_path.name}.tmp")
+                img.save(tmp_path, "WEBP", quality=self.WEBP_QUALITY)
+                tmp_path.replace(thumb_path)
+        return str(thumb_path)
+
+    def thumbnail(self, image_path, width):
+        """Ruta de la miniatura adecuada para el ancho dado; None si la imagen no existe."""
+        if not image_path:
+            return None
+        try:
+            stat = Path(image_path).stat()
+            return self._thumbnail_cached(str(image_path), stat.st_mtime_ns, stat.st_size, self._fit_size(width))
+        except OSError:
+            return None
+
+    def create_thumbnails(self, image_path):
+        """Genera todas las miniaturas de una imagen (al subirla)."""
+        return [self.thumbnail(image_path, size) for size in self.sizes]
+
+    # ===================== Carpeta de imágenes =====================
+    def list_images(self):
+        """Imágenes de la carpeta, sin duplicados por contenido; se recalcula solo si cambia la carpeta."""
+        key = self.images_folder.stat().st_mtime_ns
+        with self._lock:
+            if key != self._listing_key:
+                seen = set()
+                images = []
+                for p in sorted(self.images_folder.iterdir()):
+                    if not p.is_file() or p.suffix.lower() not in IMAGE_EXTENSIONS:
+                        continue
+                    digest = content_hash(p)
+                    if digest not in seen:
+                        seen.add(digest)
+                        images.append(str(p))
+                self._listing_key, self._listing = key, images
+            return list(self._listing)
+
+    def save_upload(self, uploaded_file):
+        """Guarda una imagen subida y crea sus miniaturas; reutiliza la existente si es idéntica."""
+        data = uploaded_file.getvalue()
+        digest = hashlib.sha1(data).hexdigest()[:16]
+        for existing in self.list_images():
+            if content_hash(existing) == digest:
+                return existing
+
+        file_path = self.images_folder / Path(uploaded_file.name).name
+        if file_path.exists():  # Evitar sobrescribir
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            file_path = self.images_folder / f"{file_path.stem}_{timestamp}{file_path.suffix}"
+
+        # Validar que es una imagen antes de escribirla
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+        file_path.write_bytes(data)
+        self.create_thumbnails(file_path)
+        return str(file_path)
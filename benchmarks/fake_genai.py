@@ -0,0 +1,161 @@
+"""Sustituto local de google.generativeai para benchmarks sin red ni API key.
+
+Simula la latencia de la primera respuesta y el ritmo de emisión de tokens, y registra
+el tamaño de cada prompt recibido. También puede cortar streams (FakeConfig.stream_failures)
+y, como la sesión real, deja inservible el historial de un chat cuyo stream no terminó.
+"""
+import sys
+import threading
+import time
+import types
+
+
+class FakeConfig:
+    """Parámetros de latencia compartidos por todos los modelos falsos."""
+    first_token_latency = 0.05  # Segundos hasta el primer fragmento
+    token_interval = 0.002  # Segundos entre fragmentos
+    response_tokens = 40  # Fragmentos por respuesta
+    stream_failures = 0  # Próximos streams que se cortarán con un error de conexión
+    stream_fail_after = 0  # Fragmentos emitidos antes del corte
+
+
+class BrokenResponseError(Exception):
+    """Como genai.types.BrokenResponseError: el último envío del chat no terminó bien."""
+
+
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, text, chunks=None, fail_after=None):
+        self.text = text
+        self.parts = [_Part(text)]
+        self._chunks = chunks
+        self._fail_after = fail_after
+        self.on_complete = None  # La sesión de chat registra el turno al terminar el stream
+
+    def __iter__(self):
+        for i, chunk in enumerate(self._chunks or [self.text]):
+            if i == self._fail_after:
+                raise ConnectionError("Stream interrumpido (simulado)")
+            time.sleep(FakeConfig.first_token_latency if i == 0 else FakeConfig.token_interval)
+            yield FakeResponse(chunk)
+        if self.on_complete is not None:
+            self.on_complete()
+
+
+class FakeChatSession:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = history
+
+    @property
+    def history(self):
+        if self._broken:
+            raise BrokenResponseError("El último stream del chat no terminó")
+        return self._history
+
+    @history.setter
+    def history(self, value):
+        self._history = list(value or [])
+        self._broken = False
+
+    def send_message(self, content, stream=False, **kwargs):
+        turn = [{"role": "user", "parts": [content]}]
+        response = self.model.generate_content([*self.history, *turn], stream=stream)
+        turn.append({"role": "model", "parts": [response.text]})
+        if not stream:
+            self._history.extend(turn)
+            return response
+
+        # Hasta consumir el stream entero el historial no es válido (y si se corta, ya no lo será)
+        self._broken = True
+
+        def complete():
+            self._history.extend(turn)
+            self._broken = False
+
+        response.on_complete = complete
+        return response
+
+
+class GenerativeModel:
+    # Tamaño (en caracteres) de cada prompt recibido, para medir su crecimiento por turno
+    prompt_sizes = []
+    _lock = threading.Lock()
+
+    def __init__(self, model_name, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        return cls(cached_content.model, system_instruction=cached_content.system_instruction)
+
+    @classmethod
+    def reset_stats(cls):
+        with cls._lock:
+            cls.prompt_sizes = []
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        size = len(str(contents)) + len(self.system_instruction or "")
+        with self._lock:
+            self.prompt_sizes.append(size)
+
+        chunks = [f"palabra{i} " for i in range(FakeConfig.response_tokens)]
+        text = "".join(chunks).strip()
+        if stream:
+            fail_after = None
+            with self._lock:
+                if FakeConfig.stream_failures > 0:
+                    FakeConfig.stream_failures -= 1
+                    fail_after = FakeConfig.stream_fail_after
+            return FakeResponse(text, chunks, fail_after)
+        time.sleep(FakeConfig.first_token_latency + FakeConfig.token_interval * len(chunks))
+        return FakeResponse(text)
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
+
+
+class CachedContent:
+    created = []  # Todas las cachés creadas, para que las pruebas cuenten y miren su estado
+
+    def __init__(self, model, system_instruction=None, ttl=None, **kwargs):
+        self.model = model
+        self.system_instruction = system_instruction
+        self.ttl = ttl
+        self.updates = 0
+        self.deleted = False
+
+    @classmethod
+    def create(cls, model, system_instruction=None, ttl=None, **kwargs):
+        cache = cls(model, system_instruction, ttl)
+        CachedContent.created.append(cache)
+        return cache
+
+    def update(self, ttl=None):
+        if self.deleted:
+            raise KeyError("caché de contexto no encontrada")
+        self.ttl = ttl
+        self.updates += 1
+
+    def delete(self):
+        self.deleted = True
+
+
+def configure(**kwargs):
+    pass
+
+
+def install():
+    """Registra este módulo como google.generativeai antes de importar character_base."""
+    module = sys.modules[__name__]
+    module.caching = types.SimpleNamespace(CachedContent=CachedContent)
+    google = sys.modules.get("google") or types.ModuleType("google")
+    google.generativeai = module
+    sys.modules["google"] = google
+    sys.modules["google.generativeai"] = module
+    return module
@@ -0,0 +1,240 @@
+"""Benchmarks offline de CharacterAI y de la persistencia/listado de chats.
+
+Uso:
+    python benchmarks/run_benchmarks.py [--turns 40] [--sessions 1 8 32] [--chats 10 1000 10000]
+        [--recall 1000 100000] [--json salida.json]
+
+No necesita red ni GOOGLE_API_KEY: google.generativeai se sustituye por benchmarks/fake_genai.py.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# El limitador compartido no debe enmascarar la latencia medida
+os.environ.setdefault("MODEL_RATE_LIMIT", "1000000")
+
+import fake_genai  # noqa: E402
+
+fake_genai.install()
+
+from character_base import CharacterAI  # noqa: E402
+from chat_store import ChatStore  # noqa: E402
+from conversation_manager import ConversationManager  # noqa: E402
+from persistence import WriteBehindQueue  # noqa: E402
+from retrieval import BM25Index  # noqa: E402
+
+PERSONALITY = "Un mago sabio y algo excéntrico que habla con metáforas antiguas. " * 4
+CHARACTER_DATA = {
+    "name": "Merlin", "personality": PERSONALITY, "greeting": "Saludos, viajero.",
+    "profile_image_path": None, "model_name": "gemini-2.0-flash",
+}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "mean_ms": statistics.fmean(values) * 1000 if values else 0.0,
+    }
+
+
+def make_character(**kwargs):
+    return CharacterAI(
+        name=CHARACTER_DATA["name"], personality=PERSONALITY, greeting=CHARACTER_DATA["greeting"],
+        model_name=CHARACTER_DATA["model_name"], **kwargs
+    )
+
+
+# ===================== Turnos =====================
+def bench_turns(turns, backend):
+    """Latencia por turno, tiempo hasta el primer token y tamaño de prompt con streaming."""
+    fake_genai.GenerativeModel.reset_stats()
+    character = make_character(backend=backend)
+    ttft, latency = [], []
+    for i in range(turns):
+        start = time.perf_counter()
+        first = None
+        for _ in character.generate_response_stream(f"Cuéntame algo sobre el hechizo número {i}"):
+            if first is None:
+                first = time.perf_counter() - start
+        latency.append(time.perf_counter() - start)
+        ttft.append(first or 0.0)
+
+    sizes = fake_genai.GenerativeModel.prompt_sizes
+    return {
+        "backend": backend, "turns": turns,
+        "turn_latency": summarize(latency), "time_to_first_token": summarize(ttft),
+        "prompt_chars": {"first": sizes[0], "last": sizes[-1], "max": max(sizes)},
+    }
+
+
+def bench_throughput(sessions, turns_per_session):
+    """Turnos por segundo con N sesiones concurrentes en el ConversationManager."""
+    manager = ConversationManager(max_concurrency=sessions)
+    try:
+        for n in range(sessions):
+            manager.add(f"bench-{n}", make_character())
+        start = time.perf_counter()
+        futures = [
+            manager.submit(f"bench-{n}", f"mensaje {t}")
+            for t in range(turns_per_session) for n in range(sessions)
+        ]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+    finally:
+        manager.shutdown()
+    total = sessions * turns_per_session
+    return {"sessions": sessions, "turns": total, "seconds": elapsed, "turns_per_second": total / elapsed}
+
+
+# ===================== Persistencia y listado =====================
+def _messages(count):
+    return [
+        {"role": "user" if i % 2 else CHARACTER_DATA["name"], "content": f"Mensaje de prueba {i} " * 8,
+         "avatar_path": None}
+        for i in range(count)
+    ]
+
+
+def bench_store(chat_counts, messages_per_chat=20, page_size=10):
+    results = []
+    for count in chat_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ChatStore(Path(tmp) / ChatStore.DB_NAME)
+            messages = _messages(messages_per_chat)
+
+            # Carga inicial (no medida) en lotes grandes
+            for offset in range(0, count, 500):
+                store.write_batch([
+                    ("save", f"chat-{n}", dict(CHARACTER_DATA, name=f"Personaje {n}"), messages)
+                    for n in range(offset, min(count, offset + 500))
+                ])
+
+            # save_character_and_chat: guardado completo de un chat
+            save = []
+            for n in range(20):
+                start = time.perf_counter()
+                store.save_chat(f"chat-{n % count}", CHARACTER_DATA, messages)
+                save.append(time.perf_counter() - start)
+
+            # Turno persistido con escritura diferida: coste en el hilo de la UI y hasta disco
+            writer = WriteBehindQueue(store, flush_interval=0.01)
+            enqueue, durable = [], []
+            for n in range(20):
+                start = time.perf_counter()
+                writer.append_messages("chat-0", messages[:2], data=CHARACTER_DATA)
+                enqueue.append(time.perf_counter() - start)
+                writer.flush()
+                durable.append(time.perf_counter() - start)
+            writer.close()
+
+            # load_chat_history
+            load = []
+            for n in range(20):
+                start = time.perf_counter()
+                store.load_chat(f"chat-{n % count}")
+                load.append(time.perf_counter() - start)
+
+            # render_chatbots_interface: primera página + total
+            listing = []
+            for _ in range(20):
+                start = time.perf_counter()
+                store.list_chats(limit=page_size)
+                store.count_chats()
+                listing.append(time.perf_counter() - start)
+
+            store.close()
+        results.append({
+            "chats": count, "save_chat": summarize(save), "append_enqueue": summarize(enqueue),
+            "append_durable": summarize(durable), "load_chat": summarize(load),
+            "list_page": summarize(listing),
+        })
+    return results
+
+
+# ===================== Recuperación =====================
+TOPICS = ["dragón", "espada", "castillo", "poción", "bosque", "estrella", "libro", "torre", "lobo", "río"]
+
+
+def bench_retrieval(message_counts, queries=200):
+    """Indexado y búsqueda BM25 sobre historiales de N mensajes."""
+    results = []
+    for count in message_counts:
+        index = BM25Index()
+        start = time.perf_counter()
+        for i in range(count):
+            topic, other = TOPICS[i % len(TOPICS)], TOPICS[(i * 7 + 3) % len(TOPICS)]
+            index.add(i, f"Usuario: Hablemos del {topic} número {i} junto al {other} y la palabra{i % 997}")
+        build = time.perf_counter() - start
+
+        lookup = []
+        for q in range(queries):
+            start = time.perf_counter()
+            index.search(f"¿Recuerdas el {TOPICS[q % len(TOPICS)]} y la palabra{q * 31 % 997}?", k=3)
+            lookup.append(time.perf_counter() - start)
+        results.append({
+            "messages": count, "index_us_per_message": build / count * 1e6, "lookup": summarize(lookup),
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--chats", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--recall", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--first-token-latency", type=float, default=fake_genai.FakeConfig.first_token_latency)
+    parser.add_argument("--token-interval", type=float, default=fake_genai.FakeConfig.token_interval)
+    parser.add_argument("--json", help="Guardar los resultados en este archivo JSON")
+    args = parser.parse_args(argv)
+
+    fake_genai.FakeConfig.first_token_latency = args.first_token_latency
+    fake_genai.FakeConfig.token_interval = args.token_interval
+
+    results = {
+        "turns": [bench_turns(args.turns, backend) for backend in (CharacterAI.BACKEND_PROMPT, CharacterAI.BACKEND_CHAT)],
+        "throughput": [bench_throughput(n, turns_per_session=5) for n in args.sessions],
+        "store": bench_store(args.chats),
+        "retrieval": bench_retrieval(args.recall),
+    }
+
+    for r in results["turns"]:
+        print(f"[turnos/{r['backend']}] p50={r['turn_latency']['p50_ms']:.1f}ms "
+              f"p95={r['turn_latency']['p95_ms']:.1f}ms ttft_p50={r['time_to_first_token']['p50_ms']:.1f}ms "
+              f"prompt={r['prompt_chars']['first']}→{r['prompt_chars']['last']} chars")
+    for r in results["throughput"]:
+        print(f"[concurrencia] sesiones={r['sessions']} {r['turns_per_second']:.1f} turnos/s")
+    for r in results["store"]:
+        print(f"[almacén] chats={r['chats']} listado_p50={r['list_page']['p50_ms']:.2f}ms "
+              f"carga_p50={r['load_chat']['p50_ms']:.2f}ms guardado_p50={r['save_chat']['p50_ms']:.2f}ms "
+              f"encolado_p50={r['append_enqueue']['p50_ms']:.3f}ms en_disco_p50={r['append_durable']['p50_ms']:.2f}ms")
+    for r in results["retrieval"]:
+        print(f"[recuperación] mensajes={r['messages']} indexado={r['index_us_per_message']:.1f}us/msg "
+              f"búsqueda_p50={r['lookup']['p50_ms']:.3f}ms p95={r['lookup']['p95_ms']:.3f}ms")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    return results
+
+
+if __name__ == "__main__":
+    main()
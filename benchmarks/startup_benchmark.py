@@ -0,0 +1,115 @@
+"""Benchmark de arranque: importaciones en frío, primera ejecución de app.py y coste de cada rerun.
+
+Uso:
+    python benchmarks/startup_benchmark.py [--reruns 20] [--json salida.json]
+
+Las importaciones se miden en intérpretes nuevos; la app se ejecuta con streamlit.testing
+(AppTest) en una carpeta temporal. No necesita red ni GOOGLE_API_KEY: las páginas medidas no
+crean modelos, y el resultado indica si google.generativeai llegó a importarse.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Módulos que importa app.py, más las dependencias pesadas como referencia
+MODULES = [
+    "streamlit", "character_base", "conversation_manager", "chat_store", "avatars",
+    "character_registry", "response_cache", "metrics",
+    "google.generativeai", "numpy", "PIL.Image", "retrieval",
+]
+
+
+def summarize(values):
+    ordered = sorted(values)
+    return {
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))] * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+    }
+
+
+def bench_imports(modules):
+    """Tiempo de importación de cada módulo en un intérprete nuevo (sin caché de sys.modules)."""
+    code = (
+        "import sys, time; sys.path.insert(0, {root!r}); start = time.perf_counter(); "
+        "import {module}; print(time.perf_counter() - start)"
+    )
+    results = {}
+    for module in modules:
+        proc = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", code.format(root=str(ROOT), module=module)],
+            capture_output=True, text=True, cwd=ROOT,
+        )
+        results[module] = float(proc.stdout.strip()) * 1000 if proc.returncode == 0 else None
+    return results
+
+
+def bench_app(reruns):
+    """Primera ejecución (incluye importaciones y recursos cacheados) y reruns de cada página."""
+    from streamlit.testing.v1 import AppTest
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copy(ROOT / "styles.css", tmp)
+        os.chdir(tmp)  # La app crea sus carpetas relativas al directorio actual
+        try:
+            start = time.perf_counter()
+            at = AppTest.from_file(str(ROOT / "app.py"), default_timeout=60).run()
+            first_run = time.perf_counter() - start
+            if at.exception:
+                raise RuntimeError(at.exception[0].value)
+
+            home = []
+            for _ in range(reruns):
+                start = time.perf_counter()
+                at.run()
+                home.append(time.perf_counter() - start)
+
+            at.button(key="btn_chatbots").click().run()
+            chatbots = []
+            for _ in range(reruns):
+                start = time.perf_counter()
+                at.run()
+                chatbots.append(time.perf_counter() - start)
+        finally:
+            os.chdir(cwd)
+
+    return {
+        "first_run_ms": first_run * 1000,
+        "genai_imported": "google.generativeai" in sys.modules,
+        "rerun_home": summarize(home), "rerun_chatbots": summarize(chatbots),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=20)
+    parser.add_argument("--json", help="Guardar los resultados en este archivo JSON")
+    args = parser.parse_args(argv)
+
+    results = {"imports_ms": bench_imports(MODULES), "app": bench_app(args.reruns)}
+
+    for module, ms in results["imports_ms"].items():
+        print(f"[import] {module}: " + ("error" if ms is None else f"{ms:.0f}ms"))
+    app = results["app"]
+    print(f"[app] primera ejecución={app['first_run_ms']:.0f}ms "
+          f"rerun_home_p50={app['rerun_home']['p50_ms']:.1f}ms "
+          f"rerun_chatbots_p50={app['rerun_chatbots']['p50_ms']:.1f}ms "
+          f"genai_importado={app['genai_imported']}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -1,92 +1,470 @@
-import google.generativeai as genai
+import datetime
+import itertools
 import os
+import sys
+import time
 from dotenv import load_dotenv
+from prompt_builder import PromptBuilder
+from model_client import ModelClient, ModelError, shared_context_model, shared_model
+from metrics import get_metrics
+from memory import ConversationMemory
 
 load_dotenv()
 
+def _create_index(path=None):
+    # retrieval importa NumPy: se carga con el primer personaje y no al arrancar la app
+    from retrieval import create_index
+    return create_index(path)
+
+class Message:
+    """Entrada compacta del historial: sin __dict__ por instancia y con el rol interned."""
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)  # Solo hay dos roles por chat: se comparte una única cadena
+        self.content = content
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content[:30]!r})"
+
 class CharacterAI:
     # Se utiliza 'gemini-2.0-flash' como valor predeterminado, aunque en _get_available_model
     # se fuerza a usar 'models/gemini-1.5-flash' por la lógica original, que he simplificado.
     DEFAULT_MODEL = "gemini-2.0-flash" 
     FALLBACK_MODEL = "models/gemini-1.5-flash" # Según la lógica de _get_available_model
 
-    def __init__(self, name, personality, greeting, profile_image_path=None, model_name=None):
+    # Backends: 'prompt' envía persona + historial en cada turno; 'chat' usa system_instruction
+    # y una sesión multi-turno nativa, lo que permite el cacheo de contexto en el servidor.
+    BACKEND_PROMPT = "prompt"
+    BACKEND_CHAT = "chat"
+    CONTEXT_CACHE_MIN_TOKENS = 4096  # Por debajo de este tamaño la API no admite cachear
+    CONTEXT_CACHE_TTL = datetime.timedelta(hours=1)
+    RECALL_K = 3  # Mensajes antiguos recuperados por turno
+    # Turno de usuario sintético delante del saludo: la sesión nativa debe empezar por el usuario
+    CHAT_OPENING = "(El usuario entra en la conversación)"
+
+    def __init__(self, name, personality, greeting, profile_image_path=None, model_name=None,
+                 backend=None, use_context_cache=False, response_cache=None, metrics=None):
         self.name = name
         self.personality = personality
         self.greeting = greeting
         self.profile_image_path = profile_image_path 
+        self.character_id = None  # Personaje guardado del que parte el chat (None: propio del chat)
         self.conversation_history = []
+        # Los mensajes que salen de la ventana alimentan el resumen acumulativo
+        self.memory = ConversationMemory(name, self._summarize)
+        # ...y el índice de recuperación (en memoria salvo que se use persist_retrieval)
+        self.retrieval = _create_index()
+        self.prompt_builder = PromptBuilder(on_evict=self._on_evict)
+        self._summary_client = None
+        
+        self.backend = backend or os.getenv("CHARACTER_BACKEND", self.BACKEND_PROMPT)
+        self.use_context_cache = use_context_cache
+        self.context_cache = None
+        self.chat = None
+        self._turn_chat = None
+        self.response_cache = response_cache  # ResponseCache opcional (compartido entre personajes)
+        self.cache_enabled = True
+        self.metrics = metrics or get_metrics()
+        self._turn = {}  # Tiempos y tamaños del turno en curso
+        self._context = None  # (resumen, líneas recuperadas) del turno en curso, ya calculados
         
-        # Configurar la API y seleccionar el modelo
-        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+        # Seleccionar el modelo (la API se configura una sola vez en model_client)
         self.model_name = model_name or self._get_available_model()
-        self.model = genai.GenerativeModel(self.model_name)
+        self._init_model()
+        
+    @classmethod
+    def from_template(cls, template, **kwargs):
+        """Crea el personaje de una plantilla del registro reutilizando su prefijo precalculado."""
+        character = cls(
+            name=template.name, personality=template.personality, greeting=template.greeting,
+            profile_image_path=template.profile_image_path, model_name=template.model_name, **kwargs
+        )
+        character.character_id = template.character_id
+        character.prompt_builder.preload_prefix(template.name, template.personality, template.prefix)
+        return character
+
+    def _init_model(self):
+        """Crea el cliente resiliente, el modelo principal y la sesión de chat si corresponde."""
+        self.client = ModelClient([self.model_name, self.FALLBACK_MODEL], self._make_model)
+        self.model = self.client.model(self.model_name)
+        if self.backend == self.BACKEND_CHAT:
+            self._start_chat()
+
+    def _make_model(self, model_name):
+        """GenerativeModel (del pool compartido) de un nombre dado según el backend."""
+        if self.backend != self.BACKEND_CHAT:
+            return shared_model(model_name)
+        
+        persona = self.prompt_builder.prefix(self.name, self.personality)
+        # La caché de contexto solo se crea para el modelo principal
+        cached = self._cached_model(persona) if model_name == self.model_name else None
+        return cached or shared_model(model_name, system_instruction=persona)
+
+    def _cached_model(self, persona):
+        """Modelo sobre la caché de contexto (compartida por persona) para personalidades largas."""
+        self.context_cache = None
+        if not self.use_context_cache or self.prompt_builder.estimate_tokens(persona) < self.CONTEXT_CACHE_MIN_TOKENS:
+            return None
+        try:
+            self.context_cache, model = shared_context_model(
+                self.model_name, persona, self.CONTEXT_CACHE_TTL,
+                display_name=f"persona-{self.name}"[:128],
+            )
+            return model
+        except Exception as e:
+            # Si el modelo no admite caché se continúa con system_instruction normal
+            print(f"No se pudo crear la caché de contexto: {e}")
+            self.context_cache = None
+            return None
+
+    def _rebuild_model(self):
+        """Vuelve a pedir los modelos al pool y rehace la sesión nativa sobre el principal."""
+        self.client.reset()
+        self.model = self.client.model(self.model_name)
+        self._start_chat()
+
+    def _refresh_context_cache(self):
+        """Renueva el TTL de la caché de contexto; si se recreó, cambia de modelo y de sesión."""
+        if self.context_cache is not None and self._make_model(self.model_name) is not self.model:
+            self._rebuild_model()
+
+    def _start_chat(self):
+        """(Re)inicia la sesión de chat nativa a partir de conversation_history."""
+        self.chat = self.model.start_chat(history=self._chat_history())
+
+    def _chat_history(self):
+        """conversation_history en el formato de historial de la sesión nativa."""
+        history = []
+        for msg in self.conversation_history:
+            role = "user" if msg.role == "Usuario" else "model"
+            if not history and role == "model":
+                # La API espera que el historial empiece con un turno del usuario; el saludo
+                # se conserva para que el modelo vea el mismo contexto que en el backend 'prompt'
+                history.append({"role": "user", "parts": [self.CHAT_OPENING]})
+            if history and history[-1]["role"] == role:
+                history[-1]["parts"].append(msg.content)  # Fusionar turnos consecutivos
+            else:
+                history.append({"role": role, "parts": [msg.content]})
+        if history and history[-1]["role"] == "user":
+            history.pop()  # Turno sin respuesta (o el que se está enviando): no se reenvía dos veces
+        return history
+
+    def load_history(self, messages, summary="", summarized_upto=0):
+        """Reconstruye el historial (y el resumen de memoria) a partir de los mensajes guardados."""
+        self.memory.reset(summary, summarized_upto)
+        if self.retrieval is not None and self.retrieval.next_index > len(messages):
+            self.retrieval.reset()  # El índice guardado no corresponde a estos mensajes
+        self.conversation_history = [
+            Message("Usuario" if msg["role"] == "user" else self.name, msg["content"]) for msg in messages
+        ]
+        if self.backend == self.BACKEND_CHAT:
+            self._start_chat()
+
+    def persist_retrieval(self, path):
+        """Sustituye el índice en memoria por uno guardado en path (se carga si ya existe)."""
+        if self.retrieval is not None:
+            self.retrieval = _create_index(path)
+
+    def export_messages(self, start=0):
+        """Mensajes del historial desde start en el formato del almacén (rol 'user' o nombre, y avatar)."""
+        return [
+            {"role": "user", "content": msg.content, "avatar_path": None} if msg.role == "Usuario"
+            else {"role": msg.role, "content": msg.content, "avatar_path": self.profile_image_path}
+            for msg in self.conversation_history[start:]
+        ]
         
+
     def _get_available_model(self):
         """Devolver 'models/gemini-1.5-flash' por defecto, siguiendo la lógica original."""
         print(f"Usando modelo: {self.FALLBACK_MODEL}")
         return self.FALLBACK_MODEL
 
-    def get_system_prompt(self):
-        """Genera el prompt del sistema y el historial de forma concisa."""
-        history = self._format_conversation_history()
-        
-        # Uso de f-strings multilínea para claridad y concisión
-        return f"""
-        Eres {self.name}. {self.personality}
-        
-        Reglas importantes:
-        - Responde SIEMPRE en primera persona como {self.name}
-        - Mantén tu personalidad en cada respuesta
-        - Sé coherente con tu carácter y forma de hablar
-        - No rompas el personaje bajo ninguna circunstancia
-        - Usa lenguaje natural y conversacional
-        - Limita tus respuestas a 2-3 párrafos máximo
-        
-        Historial de conversación:
-        {history}
+    def get_system_prompt(self, query=None):
+        """Genera el prompt del sistema y el historial a partir del constructor incremental.
+
+        query (por defecto, el último mensaje del usuario) selecciona los mensajes antiguos
+        que se recuperan del índice.
         """
+        if query is None:
+            query = next(
+                (m.content for m in reversed(self.conversation_history) if m.role == "Usuario"), ""
+            )
+        self.prompt_builder.sync(self.conversation_history)
+        return self.prompt_builder.system_prompt(
+            self.name, self.personality, self.conversation_history,
+            summary=self.memory.summary, recalled=self._recall(query)
+        )
     
     def _format_conversation_history(self):
-        """Formatea el historial de conversación (últimos 6 mensajes) de manera eficiente."""
-        if not self.conversation_history:
-            return "No hay historial previo."
-        
-        # Uso de comprensión de listas y join para formatear eficientemente
-        return '\n'.join([
-            f"{msg['role']}: {msg['content']}" 
-            for msg in self.conversation_history[-6:]
-        ])
+        """Formatea la ventana de historial (dimensionada por presupuesto de tokens)."""
+        self.prompt_builder.sync(self.conversation_history)
+        return self.prompt_builder.format_history()
     
+    def _build_prompt(self, user_message):
+        """Construye el prompt completo; el último mensaje del historial es user_message."""
+        summary, recalled = self._context or self._turn_context(user_message)
+        return self.prompt_builder.build(
+            self.name, self.personality, self.conversation_history, user_message,
+            upto=len(self.conversation_history) - 1, summary=summary, recalled=recalled
+        )
+
+    def _turn_context(self, user_message):
+        """Resumen y líneas recuperadas que se inyectan en el prompt del turno en curso."""
+        if self.backend == self.BACKEND_CHAT:
+            return "", []  # La sesión nativa no los usa
+        # Sincronizar antes de buscar para que lo recién desalojado ya esté indexado
+        self.prompt_builder.sync(self.conversation_history, len(self.conversation_history) - 1)
+        return self.memory.summary, self._recall(user_message)
+
+    def _on_evict(self, index, line):
+        """Los mensajes que salen de la ventana pasan al resumen y al índice de recuperación."""
+        self.memory.add_evicted(index, line)
+        if self.retrieval is not None:
+            self.retrieval.add(index, line)
+
+    def _recall(self, query):
+        """Líneas antiguas más relevantes para query; solo contiene mensajes fuera de la ventana."""
+        if self.retrieval is None or not query:
+            return []
+        start = time.perf_counter()
+        hits = self.retrieval.search(query, self.RECALL_K)
+        self._turn["recall_ms"] = (time.perf_counter() - start) * 1000
+        # En orden cronológico para que el modelo los lea como una secuencia
+        return [line for _, line, _ in sorted(hits)]
+
+    def _summarize(self, prompt):
+        """Condensa historial antiguo con un modelo sin persona; se ejecuta en segundo plano."""
+        if self._summary_client is None:
+            self._summary_client = ModelClient([self.model_name, self.FALLBACK_MODEL], shared_model)
+        with self.metrics.timer("summarize"):
+            response = self._summary_client.call(
+                lambda model, timeout: model.generate_content(prompt, request_options={"timeout": timeout})
+            )
+        return self._response_text(response)
+
+    @staticmethod
+    def _prime_stream(response):
+        """Pide el primer fragmento dentro del reintento para que sus errores sean recuperables."""
+        iterator = iter(response)
+        first = next(iterator, None)
+        return itertools.chain([] if first is None else [first], iterator)
+
+    @staticmethod
+    def _response_text(response):
+        try:
+            return (response.text or "").strip()
+        except ValueError:
+            # Respuestas sin partes (p. ej. bloqueadas por seguridad) no tienen texto
+            return ""
+
+    def _send(self, user_message, stream=False):
+        """Envía el turno a través del cliente resiliente (timeout, reintentos y fallback)."""
+        if self.backend == self.BACKEND_CHAT:
+            # Antes de que caduque: una caché vencida haría fallar cada turno del modelo principal
+            self._refresh_context_cache()
+
+            def operation(model, timeout):
+                # En un modelo de respaldo la conversación continúa sobre una sesión nueva
+                chat = self.chat if model is self.model else model.start_chat(history=self._chat_history())
+                try:
+                    response = chat.send_message(user_message, stream=stream, request_options={"timeout": timeout})
+                    result = self._prime_stream(response) if stream else response
+                except Exception:
+                    if chat is self.chat:
+                        self._start_chat()  # El reintento necesita una sesión sana
+                    raise
+                self._turn_chat = chat
+                return result
+            
+            # La sesión nativa reenvía el historial; la persona va en system_instruction
+            self._turn["prompt_chars"] = sum(len(m.content) for m in self.conversation_history)
+        else:
+            start = time.perf_counter()
+            prompt = self._build_prompt(user_message)
+            self._turn["prompt_build_ms"] = (time.perf_counter() - start) * 1000
+            self._turn["prompt_chars"] = len(prompt)
+            
+            def operation(model, timeout):
+                response = model.generate_content(prompt, stream=stream, request_options={"timeout": timeout})
+                return self._prime_stream(response) if stream else response
+        
+        start = time.perf_counter()
+        try:
+            return self.client.call(operation)
+        finally:
+            # En streaming incluye la espera del primer fragmento
+            self._turn["model_ms"] = (time.perf_counter() - start) * 1000
+            self._turn["model"] = self.client.last_model_name
+
+    def _finish_turn(self):
+        """Deja la sesión nativa al día una vez registrado el turno en el historial.
+
+        Si respondió un modelo de respaldo, su historial pasa a la sesión principal; si la
+        respuesta acabó bloqueada o incompleta, la sesión queda inservible y se rehace.
+        """
+        chat = self._turn_chat
+        self._turn_chat = None
+        if chat is None:
+            return
+        try:
+            history = chat.history
+        except Exception:
+            # genai lanza BrokenResponseError en cada acceso tras una respuesta que no terminó bien
+            self._start_chat()
+            return
+        if chat is not self.chat:
+            self.chat = self.model.start_chat(history=history)
+
+    def _rollback_turn(self):
+        """Retira del historial el turno fallido y rehace la sesión nativa, que ya no es válida."""
+        self.conversation_history.pop()
+        self._turn_chat = None
+        if self.backend == self.BACKEND_CHAT:
+            self._start_chat()
+
+    def _cache_key(self, user_message):
+        """Clave de caché del turno actual, o None si la caché está desactivada."""
+        if self.response_cache is None or not self.cache_enabled:
+            return None
+        # El contexto inyectado forma parte de la clave: una respuesta basada en el resumen o los
+        # recuerdos de un chat no debe servirse a otro cuyos últimos mensajes coincidan
+        self._context = self._turn_context(user_message)
+        return self.response_cache.make_key(
+            self, self.conversation_history[:-1], user_message, *self._context
+        )
+
+    def _use_cached(self, cache_key, user_message):
+        """Registra una respuesta servida desde caché; devuelve None si no hay acierto."""
+        bot_response = self.response_cache.get(cache_key) if cache_key else None
+        if bot_response is None:
+            return None
+        self.conversation_history.append(Message(self.name, bot_response))
+        if self.backend == self.BACKEND_CHAT:
+            # Mantener la sesión nativa al tanto del turno que no pasó por el modelo
+            self.chat.history = [
+                *self.chat.history,
+                {"role": "user", "parts": [user_message]},
+                {"role": "model", "parts": [bot_response]},
+            ]
+        return bot_response
+
+    def _record_turn(self, start, bot_response, cache_hit=False, error=None, stream=False):
+        """Publica las métricas del turno (tiempos, tamaños y aciertos de caché)."""
+        turn, self._turn = self._turn, {}
+        self._context = None
+        elapsed = time.perf_counter() - start
+        metrics = self.metrics
+        metrics.incr("turns")
+        metrics.observe("turn", elapsed)
+        if "prompt_build_ms" in turn:
+            metrics.observe("prompt_build", turn["prompt_build_ms"] / 1000)
+        if "recall_ms" in turn:
+            metrics.observe("recall", turn["recall_ms"] / 1000)
+        if "model_ms" in turn:
+            metrics.observe("model_call", turn["model_ms"] / 1000)
+        if "ttft_ms" in turn:
+            metrics.observe("time_to_first_token", turn["ttft_ms"] / 1000)
+        if self.response_cache is not None and self.cache_enabled:
+            metrics.incr("response_cache_hits" if cache_hit else "response_cache_misses")
+        if error is not None:
+            metrics.incr("model_errors")
+
+        prompt_chars = turn.get("prompt_chars", 0)
+        metrics.incr("prompt_chars", prompt_chars)
+        metrics.incr("response_chars", len(bot_response or ""))
+        metrics.emit({
+            "event": "turn", "unique_id": getattr(self, "unique_id", None), "character": self.name,
+            "backend": self.backend, "stream": stream, "cache_hit": cache_hit,
+            "turn_ms": elapsed * 1000, **turn,
+            "prompt_tokens": prompt_chars // self.prompt_builder.CHARS_PER_TOKEN,
+            "response_chars": len(bot_response or ""),
+            "response_tokens": self.prompt_builder.estimate_tokens(bot_response) if bot_response else 0,
+            "error": str(error) if error else None,
+        })
+
     def generate_response(self, user_message):
-        """Genera y registra la respuesta del personaje."""
-        self.conversation_history.append({"role": "Usuario", "content": user_message})
+        """Genera y registra la respuesta del personaje; lanza ModelError si el modelo no responde."""
+        start = time.perf_counter()
+        self.conversation_history.append(Message("Usuario", user_message))
+        cache_key = self._cache_key(user_message)
+        if (cached := self._use_cached(cache_key, user_message)) is not None:
+            self._record_turn(start, cached, cache_hit=True)
+            return cached
         
         try:
-            full_prompt = (
-                f"{self.get_system_prompt()}\n\n"
-                f"Usuario: {user_message}\n\n"
-                f"{self.name}:"
-            )
-            
             # Generar respuesta
-            response = self.model.generate_content(full_prompt)
+            response = self._send(user_message)
+        except ModelError as e:
+            # No dejar en el historial un turno sin respuesta
+            self._rollback_turn()
+            self._record_turn(start, None, error=e)
+            raise
+        
+        bot_response = self._response_text(response)
+        self._record_turn(start, bot_response)
+        if bot_response:
+            self.conversation_history.append(Message(self.name, bot_response))
+            if cache_key:
+                self.response_cache.set(cache_key, bot_response)
+        self._finish_turn()
+        return bot_response or "Lo siento, no pude generar una respuesta en este momento."
+
+    def generate_response_stream(self, user_message):
+        """Genera la respuesta del personaje en fragmentos a medida que llegan.
+
+        El texto completo se registra en el historial al terminar el stream; si el
+        modelo falla se lanza ModelError y el turno no se registra.
+        """
+        start = time.perf_counter()
+        self.conversation_history.append(Message("Usuario", user_message))
+        cache_key = self._cache_key(user_message)
+        if (cached := self._use_cached(cache_key, user_message)) is not None:
+            self._turn["ttft_ms"] = (time.perf_counter() - start) * 1000
+            self._record_turn(start, cached, cache_hit=True, stream=True)
+            yield cached
+            return
+        chunks = []
+        
+        try:
+            response = self._send(user_message, stream=True)
             
-            if response.text:
-                bot_response = response.text.strip()
-                self.conversation_history.append({"role": self.name, "content": bot_response})
-                return bot_response
-            else:
-                return "Lo siento, no pude generar una respuesta en este momento."
-                
+            for chunk in response:
+                # Los fragmentos sin partes (p. ej. bloqueos de seguridad) no tienen texto
+                text = getattr(chunk, "parts", None) and chunk.text
+                if text:
+                    if not chunks:
+                        self._turn["ttft_ms"] = (time.perf_counter() - start) * 1000
+                    chunks.append(text)
+                    yield text
+                    
         except Exception as e:
-            # Manejo de errores más directo
-            return f"Error: {e}"
+            self._rollback_turn()
+            error = e if isinstance(e, ModelError) else ModelError(f"El stream se interrumpió: {e}")
+            self._record_turn(start, "".join(chunks), error=error, stream=True)
+            if error is e:
+                raise
+            raise error from e
+        
+        bot_response = "".join(chunks).strip()
+        self._record_turn(start, bot_response, stream=True)
+        if bot_response:
+            self.conversation_history.append(Message(self.name, bot_response))
+            if cache_key:
+                self.response_cache.set(cache_key, bot_response)
+        self._finish_turn()
+        if not bot_response:
+            yield "Lo siento, no pude generar una respuesta en este momento."
     
     # Métodos restantes simplificados o mantenidos por su concisión
     def clear_history(self):
         """Borra el historial de conversación."""
         self.conversation_history = []
+        self.memory.reset()
+        if self.retrieval is not None:
+            self.retrieval.reset()
+        if self.backend == self.BACKEND_CHAT:
+            self._start_chat()
     
     def update_character(self, name=None, personality=None, greeting=None, profile_image_path=None):
         """Actualiza los atributos del personaje con un solo dict-like acceso."""
@@ -94,4 +472,9 @@ class CharacterAI:
         self.name = name or self.name
         self.personality = personality or self.personality
         self.greeting = greeting or self.greeting
-        self.profile_image_path = profile_image_path or self.profile_image_path
\ No newline at end of file
+        self.profile_image_path = profile_image_path or self.profile_image_path
+        self.memory.name = self.name
+        
+        # La persona forma parte de system_instruction: recrear modelo y sesión
+        if self.backend == self.BACKEND_CHAT and (name or personality):
+            self._rebuild_model()
@@ -0,0 +1,96 @@
+import json
+import threading
+from pathlib import Path
+
+from persistence import atomic_write_json
+from prompt_builder import PromptBuilder
+
+# Campos mínimos de un personaje guardado en characters/
+REQUIRED_FIELDS = ("name", "personality", "greeting")
+
+
+class CharacterTemplate:
+    """Personaje guardado, listo para iniciar chats (con su prefijo de persona ya calculado)."""
+    __slots__ = ("character_id", "name", "personality", "greeting", "profile_image_path", "model_name", "prefix")
+
+    def __init__(self, character_id, data):
+        self.character_id = character_id
+        self.name = data["name"]
+        self.personality = data["personality"]
+        self.greeting = data["greeting"]
+        self.profile_image_path = data.get("profile_image_path")
+        self.model_name = data.get("model_name")
+        self.prefix = PromptBuilder.render_prefix(self.name, self.personality)
+
+    def to_dict(self):
+        return {
+            "character_id": self.character_id, "name": self.name, "personality": self.personality,
+            "greeting": self.greeting, "profile_image_path": self.profile_image_path,
+            "model_name": self.model_name,
+        }
+
+
+class CharacterRegistry:
+    """Índice en memoria de los personajes de characters/, leído una sola vez por proceso.
+
+    Al cargar cada personaje se calculan su prefijo de persona y las miniaturas de su
+    avatar, de modo que iniciar un chat con él no vuelve a leer ni procesar nada.
+    """
+
+    def __init__(self, folder, avatars=None):
+        self.folder = Path(folder)
+        self.avatars = avatars  # AvatarCache opcional para precalcular miniaturas
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """(Re)lee la carpeta completa; devuelve el número de personajes indexados."""
+        templates = {}
+        for file_path in sorted(self.folder.glob("*.json")):
+            try:
+                data = json.loads(file_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                print(f"No se pudo cargar el personaje {file_path.name}: {e}")
+                continue
+            if not all(data.get(k) for k in REQUIRED_FIELDS):
+                continue
+            character_id = data.get("character_id") or data.get("unique_id") or file_path.stem
+            templates[character_id] = self._make_template(character_id, data)
+        with self._lock:
+            self._templates = templates
+        return len(templates)
+
+    def _make_template(self, character_id, data):
+        template = CharacterTemplate(character_id, data)
+        if self.avatars is not None and template.profile_image_path:
+            self.avatars.create_thumbnails(template.profile_image_path)
+        return template
+
+    def save(self, data):
+        """Guarda (o actualiza) un personaje en disco y en el índice; devuelve su plantilla."""
+        character_id = data.get("character_id") or data["unique_id"]
+        data = {**data, "character_id": character_id}
+        atomic_write_json(self.folder / f"{character_id}.json", data)
+        template = self._make_template(character_id, data)
+        with self._lock:
+            self._templates[character_id] = template
+        return template
+
+    def get(self, character_id):
+        with self._lock:
+            return self._templates.get(character_id)
+
+    def list(self):
+        """Plantillas ordenadas por nombre."""
+        with self._lock:
+            templates = list(self._templates.values())
+        return sorted(templates, key=lambda t: t.name.lower())
+
+    def __contains__(self, character_id):
+        with self._lock:
+            return character_id in self._templates
+
+    def __len__(self):
+        with self._lock:
+            return len(self._templates)
@@ -0,0 +1,230 @@
+import threading
+import uuid
+from pathlib import Path
+
+from character_base import CharacterAI
+from character_registry import CharacterRegistry
+from chat_store import ChatStore
+from conversation_manager import ConversationManager
+from metrics import get_metrics
+from persistence import WriteBehindQueue
+
+
+class ChatNotFoundError(LookupError):
+    """El chat (o el personaje guardado) pedido no existe."""
+
+
+class ChatEngine:
+    """Lógica de chats sin interfaz: crear, cargar, conversar y persistir.
+
+    Reúne el gestor de conversaciones, el almacén con su escritura diferida, el registro
+    de personajes y la caché de respuestas. La app de Streamlit y el modo headless
+    (headless.py) trabajan sobre la misma instancia de CharacterAI por chat.
+    """
+    DEFAULT_MODEL = "gemini-2.0-flash"
+    FLUSH_TIMEOUT = 5  # Segundos de espera a la escritura diferida antes de releer del almacén
+
+    def __init__(self, manager, store, writer, registry=None, response_cache=None, retrieval_folder=None):
+        self.manager = manager
+        self.store = store
+        self.writer = writer
+        self.registry = registry
+        self.response_cache = response_cache
+        self.retrieval_folder = Path(retrieval_folder) if retrieval_folder else None
+        self._load_lock = threading.RLock()  # Evita cargar o crear dos veces el mismo chat
+
+    @classmethod
+    def open(cls, chats_folder="saved_chats", characters_folder="characters",
+             max_concurrency=None, response_cache=None):
+        """Motor autónomo sobre las mismas carpetas que la app (para el modo headless)."""
+        Path(chats_folder).mkdir(exist_ok=True)
+        Path(characters_folder).mkdir(exist_ok=True)
+        store = ChatStore(Path(chats_folder) / ChatStore.DB_NAME)
+        store.migrate_json_folder(chats_folder)
+        return cls(
+            ConversationManager(max_concurrency=max_concurrency), store,
+            WriteBehindQueue(store, metrics=get_metrics()),
+            registry=CharacterRegistry(characters_folder), response_cache=response_cache,
+            retrieval_folder=Path(chats_folder) / "retrieval",
+        )
+
+    @staticmethod
+    def generate_unique_id():
+        return str(uuid.uuid4())
+
+    # ===================== Personajes =====================
+    @staticmethod
+    def character_data(character):
+        return {
+            "name": character.name, "personality": character.personality,
+            "greeting": character.greeting, "profile_image_path": character.profile_image_path,
+            "model_name": character.model_name, "unique_id": character.unique_id,
+            "character_id": character.character_id or character.unique_id,
+        }
+
+    def new_character(self, name, personality, greeting, profile_image_path=None, model_name=None):
+        return CharacterAI(
+            name=name, personality=personality, greeting=greeting,
+            profile_image_path=profile_image_path, model_name=model_name or self.DEFAULT_MODEL,
+            response_cache=self.response_cache,
+        )
+
+    def from_template(self, character_id):
+        """CharacterAI a partir de un personaje guardado (None si no existe)."""
+        template = self.registry.get(character_id) if self.registry is not None else None
+        if template is None:
+            return None
+        return CharacterAI.from_template(template, response_cache=self.response_cache)
+
+    # ===================== Sesiones =====================
+    def register(self, unique_id, character):
+        """Añade el personaje al gestor y persiste su resumen de memoria y su índice de recuperación."""
+        self.manager.add(unique_id, character)
+        character.memory.on_update = (
+            lambda summary, upto, writer=self.writer: writer.save_summary(unique_id, summary, upto)
+        )
+        if self.retrieval_folder is not None:
+            character.persist_retrieval(self.retrieval_folder / f"{unique_id}.npz")
+
+    def start_chat(self, character, unique_id=None):
+        """Registra un chat nuevo que empieza por el saludo y lo encola en el almacén; devuelve su ID."""
+        unique_id = unique_id or self.generate_unique_id()
+        self.register(unique_id, character)
+
+        # El saludo forma parte del historial para que los índices coincidan con los mensajes guardados
+        character.load_history([{"role": character.name, "content": character.greeting}])
+        self.writer.save_chat(unique_id, self.character_data(character), character.export_messages())
+        return unique_id
+
+    def load(self, unique_id):
+        """Reconstruye un personaje y su historial desde el almacén y lo registra (None si no existe)."""
+        data = self.store.load_chat(unique_id)
+        if data is None:
+            return None
+
+        character = self.new_character(
+            data["name"], data["personality"], data["greeting"],
+            profile_image_path=data.get("profile_image_path"), model_name=data.get("model_name"),
+        )
+        character.character_id = data.get("character_id")
+        self.register(unique_id, character)
+
+        # Recrear el historial del modelo (y la sesión de chat nativa) y su resumen desde el almacén
+        character.load_history(data["messages"], data.get("summary", ""), data.get("summarized_upto", 0))
+        return character
+
+    def get(self, unique_id):
+        """Sesión viva del chat; si el gestor la descartó (LRU) se rehidrata desde el almacén."""
+        character = self.manager.get(unique_id)
+        if character is not None:
+            return character
+        with self._load_lock:
+            character = self.manager.get(unique_id)  # Otro hilo pudo cargarlo mientras tanto
+            if character is None:
+                self.writer.flush(timeout=self.FLUSH_TIMEOUT)  # Incluir lo último encolado
+                character = self.load(unique_id)
+        return character
+
+    def open_chat(self, unique_id=None, character_id=None):
+        """ID de un chat existente o, si no existe y se indica character_id, de uno nuevo
+        creado desde ese personaje guardado (con el unique_id pedido, si lo hay)."""
+        with self._load_lock:
+            if unique_id and self.get(unique_id) is not None:
+                return unique_id
+            if not character_id:
+                raise ChatNotFoundError(f"No existe ningún chat con ID {unique_id}")
+            character = self.from_template(character_id)
+            if character is None:
+                raise ChatNotFoundError(f"No existe ningún personaje guardado con ID {character_id}")
+            return self.start_chat(character, unique_id)
+
+    def delete(self, unique_id):
+        """Elimina el chat del almacén, cierra su sesión y borra su índice de recuperación.
+
+        Se ejecuta en el turno de la sesión: un turno en curso termina antes, y los que
+        estuvieran encolados detrás ya no encuentran el chat (no lo recrean al persistir).
+        """
+        def drop():
+            self.writer.delete_chat(unique_id)
+            self.writer.flush(timeout=self.FLUSH_TIMEOUT)
+            character = self.manager.remove(unique_id)
+            if character is not None and character.retrieval is not None:
+                character.retrieval.reset()
+            if self.retrieval_folder is not None:
+                (self.retrieval_folder / f"{unique_id}.npz").unlink(missing_ok=True)
+
+        self.manager.submit_call(unique_id, drop).result()
+
+    def _live(self, unique_id):
+        """Sesión viva del chat (rehidratada si hace falta); ChatNotFoundError si no existe."""
+        character = self.get(unique_id)
+        if character is None:
+            raise ChatNotFoundError(f"No existe ningún chat con ID {unique_id}")
+        return character
+
+    # ===================== Turnos =====================
+    def persist_turn(self, character, start):
+        """Encola en la escritura diferida los mensajes del historial a partir de start (no bloquea)."""
+        self.writer.append_messages(
+            character.unique_id, character.export_messages(start), data=self.character_data(character)
+        )
+
+    def _turn(self, unique_id, user_message):
+        # Se ejecuta en el turno de la sesión: nadie más toca el historial entre medias, y el
+        # chat se resuelve aquí para respetar un borrado o un descarte LRU encolados antes
+        character = self._live(unique_id)
+        start = len(character.conversation_history)
+        response = character.generate_response(user_message)
+        self.persist_turn(character, start)
+        return response
+
+    def _stream_turn(self, unique_id, user_message):
+        character = self._live(unique_id)
+        start = len(character.conversation_history)
+        yield from character.generate_response_stream(user_message)
+        # Al acabar el stream y aún en el turno de la sesión, aunque el lector ya no esté
+        self.persist_turn(character, start)
+
+    def stream(self, unique_id, user_message):
+        """Generador con los fragmentos de la respuesta; el turno se persiste al terminar el stream.
+
+        La persistencia ocurre en el hilo del modelo y dentro del turno de la sesión, así que
+        un rerun que interrumpa la lectura o dos pestañas sobre el mismo chat no la alteran.
+        """
+        self._live(unique_id)  # Error inmediato si el chat no existe
+        return self.manager.stream_call(unique_id, lambda: self._stream_turn(unique_id, user_message))
+
+    def submit(self, unique_id, user_message):
+        """Encola un turno completo (respuesta y persistencia); devuelve un Future con la respuesta.
+
+        Los turnos de un mismo chat se ejecutan en orden y los de chats distintos en
+        paralelo, con el límite de concurrencia del gestor.
+        """
+        self._live(unique_id)  # Error inmediato si el chat no existe
+        return self.manager.submit_call(unique_id, self._turn, unique_id, user_message)
+
+    def send(self, unique_id, user_message, timeout=None):
+        return self.submit(unique_id, user_message).result(timeout)
+
+    def save(self, unique_id):
+        """Fuerza el guardado completo del chat y espera a que llegue a disco.
+
+        Se encola en el turno de la sesión: una respuesta en curso termina (y se persiste)
+        antes de tomar la copia, así que no se duplican mensajes. RuntimeError si falla.
+        """
+        def write():
+            character = self._live(unique_id)
+            self.writer.save_chat(unique_id, self.character_data(character), character.export_messages())
+
+        self._live(unique_id)
+        self.manager.submit_call(unique_id, write).result()
+        if not self.writer.flush(timeout=self.FLUSH_TIMEOUT) or self.writer.last_error:
+            raise RuntimeError(self.writer.last_error or "tiempo de espera agotado")
+
+    def close(self):
+        """Vuelca a disco lo pendiente (mensajes e índices) y detiene los hilos del motor."""
+        for character in list(self.manager.sessions.values()):
+            if character.retrieval is not None:
+                character.retrieval.save()
+        self.writer.close()
+        self.manager.shutdown()
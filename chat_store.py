@@ -0,0 +1,331 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS characters (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    personality TEXT NOT NULL,
+    greeting TEXT NOT NULL,
+    profile_image_path TEXT,
+    model_name TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chats (
+    id TEXT PRIMARY KEY,
+    character_id TEXT NOT NULL REFERENCES characters(id),
+    message_count INTEGER NOT NULL DEFAULT 0,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_upto INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    avatar_path TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_chat_seq ON messages(chat_id, seq);
+CREATE INDEX IF NOT EXISTS idx_chats_updated ON chats(updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_chats_character ON chats(character_id);
+CREATE INDEX IF NOT EXISTS idx_characters_name ON characters(name);
+"""
+
+# Columnas añadidas después de la primera versión del esquema: (tabla, columna, definición)
+MIGRATIONS = (
+    ("chats", "summary", "TEXT NOT NULL DEFAULT ''"),
+    ("chats", "summarized_upto", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+# Campos del personaje tal y como se guardaban en los JSON de saved_chats/
+CHARACTER_FIELDS = ("name", "personality", "greeting", "profile_image_path", "model_name")
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class ChatStore:
+    """Almacén indexado (SQLite en modo WAL) de personajes, chats y mensajes."""
+    DB_NAME = "chats.db"
+    PERSONALITY_PREVIEW = 100  # Caracteres de personalidad devueltos en los resúmenes
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._migrate_schema()
+
+    def _migrate_schema(self):
+        for table, column, definition in MIGRATIONS:
+            columns = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ===================== Escritura =====================
+    def _upsert_character(self, character_id, data):
+        now = _now()
+        self._conn.execute(
+            """INSERT INTO characters (id, name, personality, greeting, profile_image_path,
+                                       model_name, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(id) DO UPDATE SET
+                   name=excluded.name, personality=excluded.personality,
+                   greeting=excluded.greeting, profile_image_path=excluded.profile_image_path,
+                   model_name=excluded.model_name, updated_at=excluded.updated_at""",
+            (character_id, *(data.get(k) for k in CHARACTER_FIELDS), now, now),
+        )
+
+    def _insert_messages(self, chat_id, messages, start_seq=0):
+        now = _now()
+        self._conn.executemany(
+            "INSERT INTO messages (chat_id, seq, role, content, avatar_path, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (chat_id, start_seq + i, m["role"], m["content"], m.get("avatar_path"), now)
+                for i, m in enumerate(messages)
+            ],
+        )
+
+    def _save_chat(self, unique_id, data, messages):
+        now = _now()
+        # Los chats iniciados desde un personaje guardado comparten su fila de personaje
+        character_id = data.get("character_id") or unique_id
+        self._upsert_character(character_id, data)
+        self._conn.execute(
+            """INSERT INTO chats (id, character_id, message_count, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(id) DO UPDATE SET
+                   message_count=excluded.message_count, updated_at=excluded.updated_at""",
+            (unique_id, character_id, len(messages), now, now),
+        )
+        self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (unique_id,))
+        self._insert_messages(unique_id, messages)
+
+    def _append_messages(self, chat_id, messages, data=None):
+        row = self._conn.execute(
+            "SELECT message_count FROM chats WHERE id = ?", (chat_id,)
+        ).fetchone()
+        if row is None:
+            if data is None:
+                raise KeyError(chat_id)
+            # El chat aún no existe: se crea con los mensajes recibidos
+            self._save_chat(chat_id, data, messages)
+            return
+        self._insert_messages(chat_id, messages, start_seq=row["message_count"])
+        self._conn.execute(
+            "UPDATE chats SET message_count = message_count + ?, updated_at = ? WHERE id = ?",
+            (len(messages), _now(), chat_id),
+        )
+
+    def _delete_chat(self, chat_id):
+        row = self._conn.execute(
+            "SELECT character_id FROM chats WHERE id = ?", (chat_id,)
+        ).fetchone()
+        self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+        self._conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+        if row is not None:
+            self._conn.execute(
+                "DELETE FROM characters WHERE id = ? "
+                "AND NOT EXISTS (SELECT 1 FROM chats WHERE character_id = ?)",
+                (row["character_id"], row["character_id"]),
+            )
+
+    def _save_summary(self, chat_id, summary, summarized_upto):
+        self._conn.execute(
+            "UPDATE chats SET summary = ?, summarized_upto = ? WHERE id = ?",
+            (summary, summarized_upto, chat_id),
+        )
+
+    def save_summary(self, chat_id, summary, summarized_upto):
+        """Guarda el resumen de memoria del chat y cuántos mensajes cubre."""
+        with self._transaction():
+            self._save_summary(chat_id, summary, summarized_upto)
+
+    def save_chat(self, unique_id, data, messages):
+        """Guarda (o reemplaza) un chat completo junto con su personaje."""
+        with self._transaction():
+            self._save_chat(unique_id, data, messages)
+
+    def append_messages(self, chat_id, messages, data=None):
+        """Añade mensajes al final de un chat (una fila por mensaje).
+
+        Si el chat no existe se crea a partir de data; sin data se lanza KeyError.
+        """
+        with self._transaction():
+            self._append_messages(chat_id, messages, data)
+
+    def append_message(self, chat_id, role, content, avatar_path=None):
+        self.append_messages(chat_id, [{"role": role, "content": content, "avatar_path": avatar_path}])
+
+    def delete_chat(self, chat_id):
+        """Elimina un chat, sus mensajes y el personaje si ya no lo usa ningún chat."""
+        with self._transaction():
+            self._delete_chat(chat_id)
+
+    def write_batch(self, operations):
+        """Aplica en una sola transacción una lista de operaciones (op, chat_id, data, messages).
+
+        op es 'save', 'append', 'delete' o 'summary' (data = (resumen, mensajes cubiertos)).
+        """
+        with self._transaction():
+            for op, chat_id, data, messages in operations:
+                if op == "save":
+                    self._save_chat(chat_id, data, messages)
+                elif op == "append":
+                    self._append_messages(chat_id, messages, data)
+                elif op == "delete":
+                    self._delete_chat(chat_id)
+                elif op == "summary":
+                    self._save_summary(chat_id, *data)
+                else:
+                    raise ValueError(f"Operación desconocida: {op}")
+
+    # ===================== Lectura =====================
+    def chat_exists(self, chat_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM chats WHERE id = ?", (chat_id,)
+            ).fetchone() is not None
+
+    def version(self):
+        """Contador que se incrementa con cada escritura; sirve para invalidar cachés."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row["value"]) if row else 0
+
+    @staticmethod
+    def _search_clause(search):
+        if not search:
+            return "", ()
+        pattern = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return "WHERE ch.name LIKE ? ESCAPE '\\'", (f"%{pattern}%",)
+
+    def count_chats(self, search=None):
+        where, params = self._search_clause(search)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM chats c JOIN characters ch ON ch.id = c.character_id {where}",
+                params,
+            ).fetchone()[0]
+
+    def list_chats(self, limit=None, offset=0, search=None):
+        """Resumen de chats (sin mensajes) ordenado por última actividad.
+
+        Admite paginación (limit/offset) y búsqueda por nombre del personaje.
+        """
+        where, params = self._search_clause(search)
+        with self._lock:
+            rows = self._conn.execute(
+                f"""SELECT c.id AS unique_id, ch.name,
+                           substr(ch.personality, 1, ?) AS personality,
+                           ch.profile_image_path, c.message_count, c.updated_at
+                    FROM chats c JOIN characters ch ON ch.id = c.character_id
+                    {where}
+                    ORDER BY c.updated_at DESC, c.id
+                    LIMIT ? OFFSET ?""",
+                (self.PERSONALITY_PREVIEW, *params, -1 if limit is None else limit, offset),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def load_chat(self, chat_id):
+        """Devuelve el chat con el mismo formato que los antiguos JSON, o None si no existe."""
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT c.id AS unique_id, c.character_id, ch.name, ch.personality, ch.greeting,
+                          ch.profile_image_path, ch.model_name, c.summary, c.summarized_upto
+                   FROM chats c JOIN characters ch ON ch.id = c.character_id
+                   WHERE c.id = ?""",
+                (chat_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            messages = self._conn.execute(
+                "SELECT role, content, avatar_path FROM messages WHERE chat_id = ? ORDER BY seq",
+                (chat_id,),
+            ).fetchall()
+        data = dict(row)
+        data["messages"] = [dict(m) for m in messages]
+        return data
+
+    # ===================== Migración =====================
+    def migrate_json_folder(self, folder):
+        """Importa una única vez los chats JSON existentes de la carpeta indicada."""
+        with self._lock:
+            done = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'json_migrated'"
+            ).fetchone()
+        if done:
+            return 0
+
+        imported = 0
+        for file_path in sorted(Path(folder).glob("*.json")):
+            try:
+                data = json.loads(file_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                print(f"No se pudo migrar {file_path.name}: {e}")
+                continue
+            if not all(k in data for k in ("name", "personality", "greeting", "messages")):
+                continue
+            unique_id = data.get("unique_id", file_path.stem)
+            if not self.chat_exists(unique_id):
+                self.save_chat(unique_id, data, data["messages"])
+                imported += 1
+
+        with self._transaction():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (_now(),)
+            )
+        return imported
+
+
+class _Transaction:
+    """Transacción explícita (BEGIN IMMEDIATE) protegida por el lock del almacén.
+
+    Al confirmar incrementa la versión del almacén (meta.version).
+    """
+
+    def __init__(self, conn, lock):
+        self._conn = conn
+        self._lock = lock
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('version', 1) "
+                    "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+                )
+            self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._lock.release()
+        return False
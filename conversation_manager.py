@@ -0,0 +1,164 @@
+import asyncio
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Marcador de fin de stream entre el hilo del modelo y el consumidor
+_STREAM_END = object()
+
+
+class ConversationManager:
+    """Gestiona varias sesiones de CharacterAI indexadas por unique_id.
+
+    Las llamadas al modelo se ejecutan en un event loop propio (en un hilo de fondo),
+    en paralelo entre sesiones con un límite de concurrencia configurable y en orden
+    dentro de cada sesión. Las sesiones forman una caché LRU: al superar max_sessions
+    se descartan las menos usadas (su estado ya está en el almacén y se rehidrata al volver).
+    """
+    DEFAULT_CONCURRENCY = 4
+    DEFAULT_MAX_SESSIONS = 256
+
+    def __init__(self, max_concurrency=None, max_sessions=None):
+        self.max_concurrency = max_concurrency or int(
+            os.getenv("CHAT_MAX_CONCURRENCY", self.DEFAULT_CONCURRENCY)
+        )
+        self.max_sessions = max_sessions or int(
+            os.getenv("CHAT_MAX_SESSIONS", self.DEFAULT_MAX_SESSIONS)
+        )
+        self.sessions = OrderedDict()  # unique_id -> CharacterAI, de menos a más reciente
+        self._sessions_lock = threading.Lock()  # Varias sesiones de Streamlit comparten el gestor
+        self._session_locks = {}
+
+        # Las llamadas de genai son bloqueantes: se delegan a un pool del mismo tamaño que el límite
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="character-ai"
+        )
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="conversation-manager", daemon=True
+        )
+        self._thread.start()
+
+    # ===================== Sesiones =====================
+    def add(self, unique_id, character):
+        """Registra (o reemplaza) la sesión de un personaje."""
+        character.unique_id = unique_id
+        with self._sessions_lock:
+            self.sessions[unique_id] = character
+            self.sessions.move_to_end(unique_id)
+            self._evict()
+        return character
+
+    def get(self, unique_id):
+        """Devuelve la sesión (o None) y la marca como usada recientemente."""
+        with self._sessions_lock:
+            character = self.sessions.get(unique_id)
+            if character is not None:
+                self.sessions.move_to_end(unique_id)
+            return character
+
+    def remove(self, unique_id):
+        with self._sessions_lock:
+            self._session_locks.pop(unique_id, None)
+            return self.sessions.pop(unique_id, None)
+
+    def _evict(self):
+        """Descarta las sesiones menos recientes por encima del límite (nunca una con un turno en curso)."""
+        excess = len(self.sessions) - self.max_sessions
+        for unique_id in list(self.sessions):
+            if excess <= 0:
+                break
+            lock = self._session_locks.get(unique_id)
+            if lock is not None and lock.locked():
+                continue
+            del self.sessions[unique_id]
+            self._session_locks.pop(unique_id, None)
+            excess -= 1
+
+    def __contains__(self, unique_id):
+        return unique_id in self.sessions
+
+    def _session_lock(self, unique_id):
+        # Solo se invoca desde el event loop, por lo que no hace falta sincronizar
+        if unique_id not in self._session_locks:
+            self._session_locks[unique_id] = asyncio.Lock()
+        return self._session_locks[unique_id]
+
+    # ===================== API asíncrona =====================
+    async def arun(self, unique_id, fn, *args):
+        """Ejecuta fn(*args) en el pool en el turno de la sesión y dentro del límite de concurrencia."""
+        async with self._session_lock(unique_id):
+            async with self._semaphore:
+                return await self._loop.run_in_executor(self._executor, fn, *args)
+
+    async def agenerate(self, unique_id, user_message):
+        """Genera la respuesta de una sesión respetando el orden y el límite de concurrencia."""
+        character = self.sessions[unique_id]
+        return await self.arun(unique_id, character.generate_response, user_message)
+
+    async def agather(self, requests):
+        """Procesa en paralelo una lista de pares (unique_id, mensaje)."""
+        return await asyncio.gather(
+            *(self.agenerate(unique_id, message) for unique_id, message in requests),
+            return_exceptions=True,
+        )
+
+    async def _astream(self, unique_id, make_stream, out_queue):
+        def produce():
+            # Se consume entero aunque el lector abandone: el turno termina y se registra igual
+            try:
+                for chunk in make_stream():
+                    out_queue.put(chunk)
+            except Exception as e:
+                out_queue.put(e)
+
+        try:
+            async with self._session_lock(unique_id):
+                async with self._semaphore:
+                    await self._loop.run_in_executor(self._executor, produce)
+        except Exception as e:
+            out_queue.put(e)
+        finally:
+            out_queue.put(_STREAM_END)
+
+    # ===================== API síncrona (hilo de Streamlit) =====================
+    def submit(self, unique_id, user_message):
+        """Encola un turno y devuelve un concurrent.futures.Future con la respuesta."""
+        return asyncio.run_coroutine_threadsafe(
+            self.agenerate(unique_id, user_message), self._loop
+        )
+
+    def submit_call(self, unique_id, fn, *args):
+        """Como submit, pero con una función arbitraria ejecutada en el turno de la sesión."""
+        return asyncio.run_coroutine_threadsafe(self.arun(unique_id, fn, *args), self._loop)
+
+    def generate(self, unique_id, user_message, timeout=None):
+        return self.submit(unique_id, user_message).result(timeout)
+
+    def stream(self, unique_id, user_message):
+        """Generador síncrono con los fragmentos de la respuesta de una sesión."""
+        def make_stream():
+            # La sesión se busca ya en su turno; si no existe (LRU, borrado) el KeyError llega al lector
+            return self.sessions[unique_id].generate_response_stream(user_message)
+
+        return self.stream_call(unique_id, make_stream)
+
+    def stream_call(self, unique_id, make_stream):
+        """Como stream, con un generador make_stream() arbitrario ejecutado en el turno de la sesión."""
+        out_queue = queue.Queue()
+        asyncio.run_coroutine_threadsafe(
+            self._astream(unique_id, make_stream, out_queue), self._loop
+        )
+        while (item := out_queue.get()) is not _STREAM_END:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def shutdown(self):
+        """Detiene el event loop y el pool de hilos."""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown(wait=False)
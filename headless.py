@@ -0,0 +1,205 @@
+"""Modo headless: conversaciones con personajes sin Streamlit, por lotes JSONL o HTTP local.
+
+Uso:
+    python headless.py run lote.jsonl [--out resultados.jsonl] [--concurrency 8]
+    python headless.py serve [--host 127.0.0.1] [--port 8765] [--concurrency 8]
+
+Cada línea del lote es un objeto JSON con "message" y el chat al que va dirigido:
+    {"unique_id": "...", "message": "..."}                      chat existente
+    {"character_id": "...", "message": "..."}                   chat nuevo con un personaje guardado
+    {"unique_id": "eval-1", "character_id": "...", "message": "..."}
+                                                                el chat eval-1 se crea si no existe
+Un campo "id" opcional se copia en el resultado. Los mensajes de un mismo chat se procesan en
+el orden del archivo y los de chats distintos en paralelo; las respuestas se guardan en el
+almacén de chats igual que desde la app (saved_chats/chats.db).
+
+Endpoints del servidor:
+    POST /chats                  {"character_id"} o {"name", "personality", "greeting"} -> {"unique_id"}
+    GET  /chats/<id>             chat guardado con sus mensajes
+    POST /chats/<id>/messages    {"message"} -> {"unique_id", "response"}
+    POST /batch                  cuerpo JSONL -> resultados JSONL
+"""
+import argparse
+import io
+import json
+import sys
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from chat_engine import ChatEngine, ChatNotFoundError
+from model_client import ModelError
+from response_cache import create_response_cache
+
+CHATS_FOLDER = "saved_chats"
+CHARACTERS_FOLDER = "characters"
+PENDING_PER_WORKER = 4  # Turnos en vuelo por hilo del pool antes de dejar de leer el lote
+
+
+def _submit(engine, request):
+    """Resuelve (o crea) el chat de una línea del lote y encola su turno."""
+    message = request.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError("Falta el campo 'message'")
+    unique_id = engine.open_chat(request.get("unique_id"), request.get("character_id"))
+    return unique_id, engine.submit(unique_id, message)
+
+
+def run_batch(engine, lines, out, max_pending=None):
+    """Procesa un lote JSONL y escribe un resultado JSONL por línea, en el mismo orden.
+
+    Como mucho max_pending turnos en vuelo: el resto del lote no se lee hasta que terminan,
+    así que la memoria no depende del tamaño del archivo. Devuelve los contadores ok/error.
+    """
+    max_pending = max_pending or engine.manager.max_concurrency * PENDING_PER_WORKER
+    pending = deque()  # (resultado, future o None), en orden de entrada
+    counts = {"ok": 0, "error": 0}
+
+    def drain(limit):
+        while len(pending) > limit:
+            result, future = pending.popleft()
+            if future is not None:
+                try:
+                    result["response"] = future.result()
+                except Exception as e:
+                    result["error"] = str(e)
+            counts["error" if "error" in result else "ok"] += 1
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        result, future = {"line": number}, None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Cada línea debe ser un objeto JSON")
+            if "id" in request:
+                result["id"] = request["id"]
+            result["unique_id"], future = _submit(engine, request)
+        except (ValueError, TypeError, ChatNotFoundError) as e:
+            result["error"] = str(e)
+        pending.append((result, future))
+        drain(max_pending)
+    drain(0)
+
+    # Los resultados ya escritos deben estar también en el almacén
+    if not engine.writer.flush(timeout=engine.FLUSH_TIMEOUT):
+        print("[headless] la escritura diferida no terminó a tiempo; sigue en segundo plano", file=sys.stderr)
+    elif engine.writer.last_error:
+        print(f"[headless] error al guardar en el almacén: {engine.writer.last_error}", file=sys.stderr)
+    return counts
+
+
+def make_server(engine, port, host="127.0.0.1"):
+    """Servidor HTTP local sobre el motor; cada petición se atiende en su propio hilo."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body, content_type="application/json"):
+            if not isinstance(body, bytes):
+                body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+
+        def _route(self):
+            parts = [p for p in self.path.split("?", 1)[0].split("/") if p]
+            try:
+                if self.command == "GET" and len(parts) == 2 and parts[0] == "chats":
+                    engine.writer.flush(timeout=engine.FLUSH_TIMEOUT)
+                    chat = engine.store.load_chat(parts[1])
+                    if chat is None:
+                        raise ChatNotFoundError(f"No existe ningún chat con ID {parts[1]}")
+                    return self._send(200, chat)
+                if self.command == "POST" and parts == ["chats"]:
+                    return self._send(201, {"unique_id": self._create_chat(json.loads(self._body()))})
+                if self.command == "POST" and len(parts) == 3 and parts[0] == "chats" and parts[2] == "messages":
+                    message = json.loads(self._body()).get("message")
+                    if not isinstance(message, str) or not message.strip():
+                        raise ValueError("Falta el campo 'message'")
+                    response = engine.send(parts[1], message)
+                    return self._send(200, {"unique_id": parts[1], "response": response})
+                if self.command == "POST" and parts == ["batch"]:
+                    out = io.StringIO()
+                    run_batch(engine, self._body().splitlines(), out)
+                    return self._send(200, out.getvalue().encode("utf-8"), "application/x-ndjson")
+                self._send(404, {"error": "Ruta no encontrada"})
+            except ChatNotFoundError as e:
+                self._send(404, {"error": str(e)})
+            except (ValueError, TypeError, AttributeError, KeyError) as e:
+                self._send(400, {"error": f"Petición no válida: {e}"})
+            except ModelError as e:
+                self._send(502, {"error": str(e)})
+            except Exception as e:
+                print(f"Error atendiendo {self.command} {self.path}: {e}")
+                self._send(500, {"error": str(e)})
+
+        def _create_chat(self, request):
+            if request.get("character_id"):
+                return engine.open_chat(request.get("unique_id"), request["character_id"])
+            if request.get("unique_id") and engine.get(request["unique_id"]) is not None:
+                raise ValueError(f"Ya existe un chat con ID {request['unique_id']}")
+            character = engine.new_character(
+                request["name"], request["personality"], request["greeting"],
+                profile_image_path=request.get("profile_image_path"), model_name=request.get("model_name"),
+            )
+            return engine.start_chat(character, request.get("unique_id"))
+
+        do_GET = do_POST = _route
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats-folder", default=CHATS_FOLDER)
+    parser.add_argument("--characters-folder", default=CHARACTERS_FOLDER)
+    parser.add_argument("--concurrency", type=int, help="Llamadas simultáneas al modelo (CHAT_MAX_CONCURRENCY)")
+    parser.add_argument("--no-cache", action="store_true", help="No reutilizar respuestas de la caché")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Procesar un lote JSONL")
+    run.add_argument("input", help="Archivo JSONL ('-' para stdin)")
+    run.add_argument("--out", help="Archivo de resultados JSONL (stdout por defecto)")
+    serve = commands.add_parser("serve", help="Servidor HTTP local")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    engine = ChatEngine.open(
+        args.chats_folder, args.characters_folder, max_concurrency=args.concurrency,
+        response_cache=None if args.no_cache else create_response_cache(args.chats_folder),
+    )
+    try:
+        if args.command == "run":
+            source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+            out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+            try:
+                counts = run_batch(engine, source, out)
+            finally:
+                if source is not sys.stdin:
+                    source.close()
+                if out is not sys.stdout:
+                    out.close()
+            print(f"[headless] ok={counts['ok']} error={counts['error']}", file=sys.stderr)
+            return counts
+        server = make_server(engine, args.port, args.host)
+        print(f"[headless] escuchando en http://{args.host}:{args.port}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
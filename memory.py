@@ -0,0 +1,92 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Un pool pequeño compartido: los resúmenes nunca se ejecutan en el turno del usuario
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory")
+
+
+class ConversationMemory:
+    """Resumen acumulativo de los mensajes que salen de la ventana de historial.
+
+    Los mensajes desalojados se acumulan y se condensan en segundo plano junto con el
+    resumen anterior, de modo que el tamaño del prompt no crece con la conversación.
+    """
+    BATCH_SIZE = 6  # Mensajes desalojados que disparan una actualización del resumen
+    MAX_BATCH = 40  # Mensajes como máximo por llamada al modelo
+    MAX_SUMMARY_CHARS = 1500
+
+    PROMPT = (
+        "Resume la conversación entre el usuario y {name} para que {name} pueda recordarla.\n"
+        "Conserva hechos concretos (nombres, datos, preferencias, promesas y acontecimientos) "
+        "y omite saludos y relleno. Escribe en tercera persona, en un único párrafo de "
+        "como máximo {max_words} palabras.\n\n"
+        "Resumen anterior:\n{summary}\n\n"
+        "Mensajes nuevos:\n{lines}\n\n"
+        "Resumen actualizado:"
+    )
+
+    def __init__(self, name, summarize_fn, summary="", summarized_upto=0, on_update=None):
+        self.name = name
+        self.summarize_fn = summarize_fn  # prompt -> texto
+        self.summary = summary or ""
+        self.summarized_upto = summarized_upto  # Mensajes del historial ya cubiertos por el resumen
+        self.on_update = on_update  # Callback (summary, summarized_upto) para persistir
+        self._pending = []  # Pares (índice del mensaje, línea)
+        self._lock = threading.Lock()
+        self._future = None
+
+    def reset(self, summary="", summarized_upto=0):
+        with self._lock:
+            self.summary = summary or ""
+            self.summarized_upto = summarized_upto
+            self._pending = []
+
+    def add_evicted(self, index, line):
+        """Registra un mensaje que salió de la ventana y programa el resumen si procede."""
+        with self._lock:
+            if index < self.summarized_upto:
+                return  # Ya forma parte del resumen guardado
+            if self._pending and index <= self._pending[-1][0]:
+                return  # La ventana se reconstruyó y vuelve a desalojar mensajes ya pendientes
+            self._pending.append((index, line))
+            if len(self._pending) >= self.BATCH_SIZE and (self._future is None or self._future.done()):
+                self._future = _executor.submit(self._run)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                batch = self._pending[:self.MAX_BATCH]
+                summary = self.summary
+            if len(batch) < self.BATCH_SIZE:
+                return
+
+            prompt = self.PROMPT.format(
+                name=self.name, summary=summary or "(sin resumen previo)",
+                lines="\n".join(line for _, line in batch),
+                max_words=self.MAX_SUMMARY_CHARS // 6,
+            )
+            try:
+                new_summary = (self.summarize_fn(prompt) or "").strip()[:self.MAX_SUMMARY_CHARS]
+            except Exception as e:
+                # Se reintentará cuando se desalojen más mensajes
+                print(f"No se pudo actualizar el resumen de {self.name}: {e}")
+                return
+            if not new_summary:
+                return
+
+            with self._lock:
+                # Si se reinició la memoria mientras tanto, descartar el resultado
+                if self._pending[:len(batch)] != batch:
+                    return
+                del self._pending[:len(batch)]
+                self.summary = new_summary
+                self.summarized_upto = batch[-1][0] + 1
+                upto = self.summarized_upto
+            if self.on_update is not None:
+                self.on_update(new_summary, upto)
+
+    def wait(self, timeout=None):
+        """Espera a que termine el resumen en curso (útil en modo batch y benchmarks)."""
+        future = self._future
+        if future is not None:
+            future.result(timeout)
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from persistence import atomic_write_text
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+class JsonlSink:
+    """Añade cada evento como una línea JSON a un archivo de log."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def emit(self, event, metrics):
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class PrometheusFileSink:
+    """Reescribe (de forma atómica) un archivo con las métricas en formato de texto Prometheus."""
+
+    def __init__(self, path, min_interval=1.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.min_interval = min_interval  # Evita reescribir el archivo en cada evento
+        self._last_write = 0.0
+
+    def emit(self, event, metrics):
+        now = time.monotonic()
+        if now - self._last_write >= self.min_interval:
+            self._last_write = now
+            atomic_write_text(self.path, metrics.prometheus_text())
+
+
+class Metrics:
+    """Contadores, tiempos y eventos por turno con sinks intercambiables."""
+    WINDOW = 1000  # Observaciones recientes guardadas por métrica para los percentiles
+    PREFIX = "chatbot_"
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.counters = {}
+        self.timings = {}
+        self.last_turn = None
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            window = self.timings.setdefault(name, [deque(maxlen=self.WINDOW), 0, 0.0])
+            window[0].append(seconds)
+            window[1] += 1
+            window[2] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def emit(self, event):
+        """Envía un evento estructurado a todos los sinks (sus errores no afectan al turno)."""
+        event = {"ts": datetime.now().isoformat(timespec="milliseconds"), **event}
+        if event.get("event") == "turn":
+            self.last_turn = event
+        for sink in self.sinks:
+            try:
+                sink.emit(event, self)
+            except Exception as e:
+                print(f"Error en el sink de métricas {type(sink).__name__}: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            timings = {name: (sorted(w[0]), w[1], w[2]) for name, w in self.timings.items()}
+        return {
+            "counters": counters,
+            "timings": {
+                name: {
+                    "count": count, "sum_s": total,
+                    "p50_ms": _percentile(values, 50) * 1000, "p95_ms": _percentile(values, 95) * 1000,
+                }
+                for name, (values, count, total) in timings.items()
+            },
+        }
+
+    def prometheus_text(self):
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap["counters"].items()):
+            metric = f"{self.PREFIX}{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, t in sorted(snap["timings"].items()):
+            metric = f"{self.PREFIX}{name}_seconds"
+            lines += [
+                f"# TYPE {metric} summary",
+                f'{metric}{{quantile="0.5"}} {t["p50_ms"] / 1000:.6f}',
+                f'{metric}{{quantile="0.95"}} {t["p95_ms"] / 1000:.6f}',
+                f"{metric}_sum {t['sum_s']:.6f}",
+                f"{metric}_count {t['count']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def serve_prometheus(metrics, port, host="127.0.0.1"):
+    """Expone /metrics en texto Prometheus desde un hilo en segundo plano."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_metrics():
+    """Registro del proceso, configurado desde el entorno.
+
+    METRICS_JSONL: log de eventos; METRICS_PROM_FILE: archivo Prometheus;
+    METRICS_PORT: endpoint HTTP /metrics.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Metrics()
+            if path := os.getenv("METRICS_JSONL"):
+                _default.add_sink(JsonlSink(path))
+            if path := os.getenv("METRICS_PROM_FILE"):
+                _default.add_sink(PrometheusFileSink(path))
+            if port := os.getenv("METRICS_PORT"):
+                serve_prometheus(_default, int(port))
+        return _default
@@ -0,0 +1,270 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# Códigos HTTP que indican un fallo transitorio (cuota, sobrecarga, timeout)
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class ModelError(Exception):
+    """La llamada al modelo falló tras agotar reintentos y modelos de respaldo."""
+
+
+class CircuitOpenError(ModelError):
+    """Todos los modelos disponibles tienen el circuito abierto."""
+
+
+def is_retryable(exc):
+    """True si el error es transitorio y merece un reintento con backoff."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    # Las excepciones de google.api_core exponen el código HTTP en .code
+    return getattr(exc, "code", None) in RETRYABLE_STATUS
+
+
+class TokenBucket:
+    """Limitador de tasa (token bucket) seguro entre hilos."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate  # Tokens por segundo
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """Consume un token esperando como máximo timeout segundos; devuelve False si no llega."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Corta las llamadas a un modelo tras varios fallos seguidos y lo reprueba pasado un tiempo."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        return self.state != "open"
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                # En half-open un único fallo vuelve a abrir el circuito
+                self._opened_at = time.monotonic()
+
+
+# Estado compartido por todas las sesiones del proceso
+_shared_lock = threading.Lock()
+_shared_limiter = None
+_breakers = {}
+_genai = None
+_model_pool = OrderedDict()  # (modelo, system_instruction) -> GenerativeModel
+MODEL_POOL_SIZE = 128
+_context_lock = threading.Lock()  # Aparte: crear o renovar una caché es una llamada de red
+_context_caches = {}  # (modelo, persona) -> [CachedContent, GenerativeModel, caducidad (monotonic)]
+
+
+def genai_module():
+    """google.generativeai importado y configurado una única vez por proceso.
+
+    La importación (gRPC y protobuf, casi un segundo) se difiere hasta que hace falta un modelo.
+    """
+    global _genai
+    with _shared_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+            _genai = genai
+        return _genai
+
+
+def shared_model(model_name, system_instruction=None):
+    """GenerativeModel reutilizado por todos los personajes con la misma configuración.
+
+    Los modelos no guardan estado de conversación (cada sesión de chat es independiente).
+    """
+    genai = genai_module()
+    key = (model_name, system_instruction)
+    with _shared_lock:
+        model = _model_pool.get(key)
+        if model is None:
+            model = _model_pool[key] = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+            while len(_model_pool) > MODEL_POOL_SIZE:
+                _model_pool.popitem(last=False)
+        else:
+            _model_pool.move_to_end(key)
+        return model
+
+
+def shared_context_model(model_name, system_instruction, ttl, display_name=None):
+    """(CachedContent, GenerativeModel) con la persona en una caché de contexto del servidor.
+
+    Hay una sola caché por (modelo, persona) en todo el proceso. Su TTL se renueva con el uso
+    cuando queda menos de la mitad; si la renovación falla o ya caducó, se borra y se crea
+    otra, y el modelo devuelto cambia (quien lo guarde debe comparar y reconstruir su sesión).
+    Las que dejan de usarse caducan solas. Propaga el error de genai si no se puede crear.
+    """
+    genai = genai_module()
+    key = (model_name, system_instruction)
+    seconds = ttl.total_seconds()
+    with _context_lock:
+        entry = _context_caches.get(key)
+        now = time.monotonic()
+        if entry is not None and entry[2] - now > seconds / 2:
+            return entry[0], entry[1]
+        if entry is not None:
+            if entry[2] > now:
+                try:
+                    entry[0].update(ttl=ttl)
+                    entry[2] = now + seconds
+                    return entry[0], entry[1]
+                except Exception as e:
+                    print(f"No se pudo renovar la caché de contexto: {e}")
+            try:
+                entry[0].delete()
+            except Exception:
+                pass  # Ya caducada en el servidor
+            del _context_caches[key]
+
+        cache = genai.caching.CachedContent.create(
+            model=model_name, display_name=display_name,
+            system_instruction=system_instruction, ttl=ttl,
+        )
+        model = genai.GenerativeModel.from_cached_content(cached_content=cache)
+        _context_caches[key] = [cache, model, now + seconds]
+        return cache, model
+
+
+def shared_rate_limiter():
+    """Limitador común a todas las sesiones (MODEL_RATE_LIMIT peticiones/segundo)."""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            rate = float(os.getenv("MODEL_RATE_LIMIT", "5"))
+            _shared_limiter = TokenBucket(rate, capacity=int(os.getenv("MODEL_RATE_BURST", "0")) or None)
+        return _shared_limiter
+
+
+def circuit_breaker(model_name):
+    """Circuit breaker compartido por nombre de modelo."""
+    with _shared_lock:
+        if model_name not in _breakers:
+            _breakers[model_name] = CircuitBreaker()
+        return _breakers[model_name]
+
+
+class ModelClient:
+    """Capa resiliente sobre genai.GenerativeModel.
+
+    Aplica a cada operación límite de tasa compartido, timeout por llamada y plazo total,
+    reintentos con backoff exponencial con jitter ante errores transitorios, circuit breaker
+    por modelo y conmutación automática a los modelos de respaldo.
+    """
+    TIMEOUT = 30.0  # Segundos por llamada
+    DEADLINE = 90.0  # Segundos para el turno completo, incluidos reintentos
+    MAX_RETRIES = 3
+    BASE_DELAY = 0.5
+    MAX_DELAY = 8.0
+
+    def __init__(self, model_names, model_factory, timeout=None, deadline=None,
+                 max_retries=None, rate_limiter=None):
+        # Orden de preferencia sin duplicados: principal primero, después los de respaldo
+        self.model_names = list(dict.fromkeys(model_names))
+        self.model_factory = model_factory
+        self.timeout = timeout or self.TIMEOUT
+        self.deadline = deadline or self.DEADLINE
+        self.max_retries = self.MAX_RETRIES if max_retries is None else max_retries
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self._models = {}
+        self.last_model_name = None
+
+    def model(self, model_name):
+        """GenerativeModel para el nombre dado (creado una sola vez)."""
+        if model_name not in self._models:
+            self._models[model_name] = self.model_factory(model_name)
+        return self._models[model_name]
+
+    def reset(self):
+        """Descarta los modelos creados (p. ej. al cambiar la persona)."""
+        self._models.clear()
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.MAX_DELAY, self.BASE_DELAY * 2 ** attempt))
+
+    def call(self, operation):
+        """Ejecuta operation(model, timeout) con reintentos y fallback; lanza ModelError."""
+        start = time.monotonic()
+        last_error = None
+        tried = False
+
+        for model_name in self.model_names:
+            breaker = circuit_breaker(model_name)
+            if not breaker.allow():
+                continue
+            tried = True
+
+            for attempt in range(self.max_retries + 1):
+                remaining = self.deadline - (time.monotonic() - start)
+                if remaining <= 0 or not self.rate_limiter.acquire(timeout=remaining):
+                    raise ModelError(f"Plazo agotado tras {self.deadline:.0f}s: {last_error}")
+
+                try:
+                    result = operation(self.model(model_name), min(self.timeout, remaining))
+                except Exception as e:
+                    last_error = e
+                    if not is_retryable(e):
+                        # Error de la petición (400, bloqueo de seguridad...): no dice nada de la
+                        # salud del modelo, así que no cuenta para su circuito compartido
+                        break  # Probar con el siguiente modelo
+                    breaker.record_failure()
+                    if not breaker.allow():
+                        break
+                    if attempt < self.max_retries:
+                        time.sleep(min(self._backoff(attempt), max(0, self.deadline - (time.monotonic() - start))))
+                    continue
+
+                breaker.record_success()
+                self.last_model_name = model_name
+                return result
+
+            print(f"Modelo {model_name} no disponible: {last_error}")
+
+        if not tried:
+            raise CircuitOpenError("Todos los modelos tienen el circuito abierto")
+        raise ModelError(str(last_error))
@@ -0,0 +1,214 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+def atomic_write_text(path, text):
+    """Escribe un archivo de forma atómica: archivo temporal + fsync + os.replace."""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_bytes(path, data):
+    """Variante binaria de atomic_write_text."""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_json(path, data):
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+
+
+class WriteBehindQueue:
+    """Persistencia diferida de chats sobre un ChatStore.
+
+    Las escrituras se encolan sin bloquear al hilo de la interfaz, se fusionan por chat
+    (varias inserciones se convierten en una, un guardado completo absorbe las anteriores)
+    y un hilo de fondo las aplica por lotes en una única transacción. Si el lote falla,
+    sus operaciones se reintentan una a una; la que siga fallando se descarta tras
+    MAX_RETRIES intentos para no bloquear al resto ni a flush().
+    """
+    FLUSH_INTERVAL = 0.5  # Segundos que se esperan para agrupar escrituras en un lote
+    MAX_RETRIES = 3  # Reintentos de una operación fallida antes de descartarla
+
+    def __init__(self, store, flush_interval=None, metrics=None):
+        self.store = store
+        self.metrics = metrics  # Registro de metrics.Metrics opcional
+        self.flush_interval = self.FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.last_error = None
+        self._pending = {}  # chat_id -> [op, data, messages], en orden de llegada
+        self._summaries = {}  # chat_id -> (resumen, mensajes cubiertos); solo cuenta el último
+        self._retries = {}  # (es_resumen, chat_id) -> reintentos de su operación fallida
+        self._inflight = False
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ===================== Encolado =====================
+    def _merge(self, op, chat_id, data=None, messages=()):
+        entry = self._pending.get(chat_id)
+        messages = [dict(m) for m in messages]  # Copia: la interfaz sigue mutando sus listas
+
+        if op == "append" and entry is not None and entry[0] != "delete":
+            entry[1] = data or entry[1]
+            entry[2].extend(messages)
+        elif op == "append" and entry is not None:
+            # Añadir tras un borrado equivale a recrear el chat solo con esos mensajes
+            self._pending[chat_id] = ["save", data, messages]
+        else:
+            self._pending.pop(chat_id, None)
+            self._pending[chat_id] = [op, data, messages]
+
+    def _enqueue(self, op, chat_id, data=None, messages=()):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("La cola de escritura está cerrada")
+            self._merge(op, chat_id, data, messages)
+            self._cond.notify_all()
+
+    def save_chat(self, chat_id, data, messages):
+        """Encola el guardado completo de un chat (reemplaza sus mensajes)."""
+        self._enqueue("save", chat_id, data, messages)
+
+    def append_messages(self, chat_id, messages, data=None):
+        """Encola mensajes nuevos; data permite crear el chat si aún no existe."""
+        self._enqueue("append", chat_id, data, messages)
+
+    def delete_chat(self, chat_id):
+        """Encola el borrado de un chat descartando sus escrituras pendientes."""
+        with self._cond:
+            self._summaries.pop(chat_id, None)
+        self._enqueue("delete", chat_id)
+
+    def save_summary(self, chat_id, summary, summarized_upto):
+        """Encola el resumen de memoria de un chat (se aplica tras sus mensajes)."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("La cola de escritura está cerrada")
+            self._summaries[chat_id] = (summary, summarized_upto)
+            self._cond.notify_all()
+
+    # ===================== Hilo de escritura =====================
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._summaries and not self._closed:
+                    self._cond.wait()
+                if not self._pending and not self._summaries and self._closed:
+                    return
+                # Dar margen para que lleguen más escrituras y agruparlas en el mismo lote
+                self._cond.wait_for(lambda: self._closed or self._flush_requested, self.flush_interval)
+                self._flush_requested = False
+                batch = [(op, chat_id, data, messages)
+                         for chat_id, (op, data, messages) in self._pending.items()]
+                batch += [("summary", chat_id, summary, ()) for chat_id, summary in self._summaries.items()]
+                self._pending, self._summaries = {}, {}
+                self._inflight = True
+
+            failed = self._write(batch)
+
+            with self._cond:
+                self._inflight = False
+                self.last_error = failed[-1][1] if failed else None
+                failed_keys = {(item[0] == "summary", item[1]) for item, _ in failed}
+                for op, chat_id, _, _ in batch:
+                    if (op == "summary", chat_id) not in failed_keys:
+                        self._retries.pop((op == "summary", chat_id), None)
+                if failed:
+                    # Reencolar lo fallido por delante de lo que haya llegado entretanto
+                    newer, self._pending = self._pending, {}
+                    for (op, chat_id, data, messages), error in failed:
+                        key = (op == "summary", chat_id)
+                        self._retries[key] = self._retries.get(key, 0) + 1
+                        if self._retries[key] > self.MAX_RETRIES:
+                            del self._retries[key]
+                            print(f"Se descarta la escritura '{op}' del chat {chat_id}: {error}")
+                            if self.metrics is not None:
+                                self.metrics.incr("storage_dropped")
+                        elif op == "summary":
+                            self._summaries.setdefault(chat_id, data)
+                        else:
+                            self._merge(op, chat_id, data, messages)
+                    for chat_id, (op, data, messages) in newer.items():
+                        self._merge(op, chat_id, data, messages)
+                    if self._closed:
+                        return  # No reintentar indefinidamente al cerrar
+                self._cond.notify_all()
+                if failed:
+                    self._cond.wait(self.flush_interval)
+
+    def _write(self, batch):
+        """Aplica el lote en una transacción; si falla, cada operación por separado.
+
+        Devuelve [(operación, error)] con las que no se pudieron escribir.
+        """
+        start = time.perf_counter()
+        try:
+            self.store.write_batch(batch)
+            if self.metrics is not None:
+                self.metrics.observe("storage_write", time.perf_counter() - start)
+                self.metrics.incr("storage_batches")
+                self.metrics.incr("storage_operations", len(batch))
+            return []
+        except Exception as e:
+            if self.metrics is not None:
+                self.metrics.incr("storage_errors")
+            print(f"Error en la escritura diferida: {e}")
+            if len(batch) == 1:
+                return [(batch[0], e)]
+
+        # Aislar la operación culpable para que no arrastre al resto del lote
+        failed = []
+        for item in batch:
+            try:
+                self.store.write_batch([item])
+                if self.metrics is not None:
+                    self.metrics.incr("storage_operations")
+            except Exception as e:
+                failed.append((item, e))
+        return failed
+
+    def flush(self, timeout=None):
+        """Bloquea hasta que todas las escrituras pendientes estén en disco."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: (not self._pending and not self._summaries and not self._inflight)
+                or not self._thread.is_alive(),
+                timeout,
+            )
+
+    def close(self):
+        """Vacía la cola y detiene el hilo de escritura."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
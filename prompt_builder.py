@@ -0,0 +1,115 @@
+from collections import deque
+
+
+class PromptBuilder:
+    """Ensambla el prompt de un personaje de forma incremental.
+
+    El prefijo estático (persona + reglas) se cachea por personaje y la ventana de
+    historial se actualiza mensaje a mensaje, dimensionada por un presupuesto
+    estimado de tokens en lugar de un número fijo de mensajes.
+    """
+    CHARS_PER_TOKEN = 4  # Aproximación habitual para texto en español/inglés
+    DEFAULT_HISTORY_BUDGET = 1500  # Tokens reservados para el historial
+    EMPTY_HISTORY = "No hay historial previo."
+
+    RULES = (
+        "Reglas importantes:\n"
+        "- Responde SIEMPRE en primera persona como {name}\n"
+        "- Mantén tu personalidad en cada respuesta\n"
+        "- Sé coherente con tu carácter y forma de hablar\n"
+        "- No rompas el personaje bajo ninguna circunstancia\n"
+        "- Usa lenguaje natural y conversacional\n"
+        "- Limita tus respuestas a 2-3 párrafos máximo"
+    )
+
+    def __init__(self, history_budget=None, on_evict=None):
+        self.history_budget = history_budget or self.DEFAULT_HISTORY_BUDGET
+        self.on_evict = on_evict  # Callback (índice, línea) para los mensajes que salen de la ventana
+        self._prefix_key = None
+        self._prefix = ""
+        self._reset_window()
+
+    @classmethod
+    def estimate_tokens(cls, text):
+        return len(text) // cls.CHARS_PER_TOKEN + 1
+
+    def _reset_window(self, history=None):
+        self._window = deque()  # Tuplas (línea formateada, tokens estimados, índice en el historial)
+        self._window_tokens = 0
+        self._history_ref = history
+        self._synced = 0  # Mensajes del historial ya incorporados a la ventana
+
+    # ===================== Prefijo =====================
+    @classmethod
+    def render_prefix(cls, name, personality):
+        return f"Eres {name}. {personality}\n\n{cls.RULES.format(name=name)}"
+
+    def prefix(self, name, personality):
+        """Devuelve el bloque de persona y reglas, recalculándolo solo si cambia el personaje."""
+        if (name, personality) != self._prefix_key:
+            self.preload_prefix(name, personality, self.render_prefix(name, personality))
+        return self._prefix
+
+    def preload_prefix(self, name, personality, prefix):
+        """Usa un prefijo ya calculado (p. ej. el de un personaje guardado, compartido entre chats)."""
+        self._prefix_key = (name, personality)
+        self._prefix = prefix
+
+    # ===================== Ventana de historial =====================
+    def sync(self, history, upto=None):
+        """Incorpora a la ventana los mensajes nuevos de history[:upto]."""
+        upto = len(history) if upto is None else upto
+        # Historial reemplazado (clear_history) o recortado: reconstruir desde cero
+        if history is not self._history_ref or upto < self._synced:
+            self._reset_window(history)
+
+        for index in range(self._synced, upto):
+            msg = history[index]
+            self._append_line(f"{msg.role}: {msg.content}", index)
+        self._synced = upto
+
+    def _append_line(self, line, index):
+        budget_chars = self.history_budget * self.CHARS_PER_TOKEN
+        if len(line) > budget_chars:
+            line = line[:budget_chars]
+        tokens = self.estimate_tokens(line)
+        self._window.append((line, tokens, index))
+        self._window_tokens += tokens
+
+        # Desalojar los mensajes más antiguos mientras se supere el presupuesto
+        while self._window_tokens > self.history_budget and len(self._window) > 1:
+            self._evict(self._window.popleft())
+
+    def _evict(self, entry):
+        self._window_tokens -= entry[1]
+        if self.on_evict is not None:
+            self.on_evict(entry[2], entry[0])
+
+    def format_history(self):
+        if not self._window:
+            return self.EMPTY_HISTORY
+        return "\n".join(entry[0] for entry in self._window)
+
+    # ===================== Ensamblado =====================
+    def system_prompt(self, name, personality, history, upto=None, summary=None, recalled=None):
+        """recalled: líneas antiguas relevantes recuperadas fuera de la ventana."""
+        self.sync(history, upto)
+        memory = f"Resumen de la conversación anterior:\n{summary}\n\n" if summary else ""
+        recall = (
+            "Fragmentos relevantes de la conversación anterior:\n" + "\n".join(recalled) + "\n\n"
+            if recalled else ""
+        )
+        return (
+            f"{self.prefix(name, personality)}\n\n"
+            f"{memory}"
+            f"{recall}"
+            f"Historial de conversación:\n{self.format_history()}"
+        )
+
+    def build(self, name, personality, history, user_message, upto=None, summary=None, recalled=None):
+        """Prompt completo para un turno; history[:upto] no debe incluir user_message."""
+        return (
+            f"{self.system_prompt(name, personality, history, upto, summary, recalled)}\n\n"
+            f"Usuario: {user_message}\n\n"
+            f"{name}:"
+        )
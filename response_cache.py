@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+
+class MemoryBackend:
+    """Backend en memoria con expulsión LRU por número de entradas."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (valor, expira_en)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[1] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskBackend:
+    """Backend persistente en SQLite con expulsión LRU por número de entradas."""
+
+    def __init__(self, db_path, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS response_cache (
+                   key TEXT PRIMARY KEY,
+                   value TEXT NOT NULL,
+                   expires_at REAL NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_response_cache_access ON response_cache(last_access)"
+        )
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key)
+            )
+            return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            # Expulsar primero lo caducado y después lo menos usado
+            self._conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "  SELECT key FROM response_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """Caché de respuestas indexada por personaje + historial reciente + mensaje normalizados.
+
+    La normalización (minúsculas, sin tildes ni signos, espacios colapsados) hace que
+    variantes como "¿Quién eres?" y "quien eres" compartan clave.
+    """
+    DEFAULT_TTL = 24 * 3600  # Segundos
+    HISTORY_WINDOW = 2  # Mensajes previos que forman parte de la clave
+
+    def __init__(self, backend=None, ttl=None, history_window=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl or self.DEFAULT_TTL
+        self.history_window = self.HISTORY_WINDOW if history_window is None else history_window
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text):
+        text = unicodedata.normalize("NFKD", text.lower())
+        text = "".join(c for c in text if not unicodedata.combining(c))
+        text = re.sub(r"[^\w\s]", " ", text)
+        return " ".join(text.split())
+
+    def make_key(self, character, history, user_message, summary="", recalled=()):
+        """summary y recalled son el contexto extra del prompt; entran tal cual en la clave."""
+        recent = history[-self.history_window:] if self.history_window else []
+        payload = json.dumps([
+            character.name, character.personality, character.model_name,
+            [(m.role, self.normalize(m.content)) for m in recent],
+            self.normalize(user_message), summary or "", list(recalled),
+        ], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits, "misses": self.misses, "entries": len(self.backend),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def create_response_cache(folder):
+    """Caché según el entorno: RESPONSE_CACHE_BACKEND=disk la persiste en SQLite dentro de folder."""
+    if os.getenv("RESPONSE_CACHE_BACKEND", "memory") == "disk":
+        Path(folder).mkdir(exist_ok=True)
+        return ResponseCache(DiskBackend(Path(folder) / "response_cache.db"))
+    return ResponseCache(MemoryBackend())
@@ -0,0 +1,356 @@
+import io
+import math
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from model_client import genai_module
+from persistence import atomic_write_bytes
+
+# Guardados a disco e indexado por embeddings: nunca en el turno del usuario
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval")
+
+_TOKEN_RE = re.compile(r"\w+")
+MAX_TOKEN_LEN = 32
+STOPWORDS = frozenset(
+    "de la que el en y a los se del las un por con no una su para es al lo como mas o pero sus le ya "
+    "este si porque esta entre cuando muy sin sobre tambien me hasta hay donde quien desde todo nos "
+    "durante todos uno les ni contra otros ese eso ante ellos e esto mi antes algunos que unos yo otro "
+    "otras otra el tanto esa estos mucho quienes nada muchos cual poco ella estar estas algunas algo "
+    "nosotros tu te ti tus the and of to in is it you that was for on are with as be at this have or "
+    "an by not but what all were we when your can there so if do my me".split()
+)
+
+
+def tokenize(text):
+    """Términos normalizados (minúsculas, sin tildes ni palabras vacías) de un texto."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [
+        t for t in _TOKEN_RE.findall(text)
+        if 1 < len(t) <= MAX_TOKEN_LEN and t not in STOPWORDS
+    ]
+
+
+class _Growable:
+    """Array de NumPy con capacidad que se duplica al añadir elementos."""
+    __slots__ = ("data", "size")
+
+    def __init__(self, dtype, capacity=8, data=None):
+        if data is not None:
+            self.data = np.array(data, dtype=dtype)
+            self.size = len(self.data)
+        else:
+            self.data = np.empty(capacity, dtype=dtype)
+            self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self.data = np.resize(self.data, max(8, 2 * len(self.data)))
+        self.data[self.size] = value
+        self.size += 1
+
+    def view(self):
+        return self.data[:self.size]
+
+
+class RetrievalIndex:
+    """Índice local de los mensajes de un chat para recuperar intercambios antiguos.
+
+    Los mensajes se añaden en orden por su índice en el historial (los repetidos se
+    ignoran, así que reconstruir la ventana no duplica entradas). Con path el índice se
+    carga al crearse y se guarda cada SAVE_EVERY mensajes en un .npz.
+    """
+    SAVE_EVERY = 100  # Mensajes nuevos entre guardados a disco
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._generation = 0  # Invalida los guardados en curso tras un reset
+        self._unsaved = 0
+        self._clear()
+        if self.path is not None and self.path.exists():
+            try:
+                with np.load(self.path, allow_pickle=False) as state:
+                    self._load_state(state)
+            except Exception as e:
+                # Un índice corrupto se reconstruye a partir del historial
+                print(f"No se pudo cargar el índice {self.path.name}: {e}")
+                self._clear()
+
+    def _clear(self):
+        self._lines = []
+        self._message_index = _Growable(np.int64)
+
+    @property
+    def next_index(self):
+        """Índice del primer mensaje del historial que aún no está indexado."""
+        with self._lock:
+            return int(self._message_index.data[self._message_index.size - 1]) + 1 if self._lines else 0
+
+    def __len__(self):
+        return len(self._lines)
+
+    def add(self, index, line):
+        """Indexa el mensaje index del historial (ya formateado como 'rol: contenido')."""
+        with self._lock:
+            if self._lines and index <= self._message_index.data[self._message_index.size - 1]:
+                return
+            self._lines.append(line)
+            self._message_index.append(index)
+            self._add(len(self._lines) - 1, line)
+            self._unsaved += 1
+            if self.path is not None and self._unsaved >= self.SAVE_EVERY:
+                self._unsaved = 0
+                _executor.submit(self.save)
+
+    def search(self, query, k=3):
+        """Hasta k tuplas (índice del mensaje, línea, puntuación) de mayor a menor relevancia."""
+        if not self._lines or k <= 0:
+            return []
+        query = self._prepare_query(query)
+        with self._lock:
+            ids, scores = self._scores(query)
+            if len(ids) == 0:
+                return []
+            if len(ids) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                ids, scores = ids[top], scores[top]
+            order = np.argsort(-scores, kind="stable")
+            return [
+                (int(self._message_index.data[ids[i]]), self._lines[ids[i]], float(scores[i]))
+                for i in order
+            ]
+
+    def reset(self):
+        """Vacía el índice y elimina su archivo (p. ej. al borrar el historial)."""
+        with self._lock:
+            self._generation += 1
+            self._unsaved = 0
+            self._clear()
+            if self.path is not None:
+                self.path.unlink(missing_ok=True)
+
+    def save(self):
+        """Escribe el índice completo en path de forma atómica."""
+        if self.path is None:
+            return
+        # Copia consistente bajo el lock; la serialización y la escritura van fuera
+        with self._lock:
+            generation = self._generation
+            lines = list(self._lines)
+            state = self._dump_state()
+            state["message_index"] = self._message_index.view()
+
+        encoded = [line.encode("utf-8") for line in lines]
+        state["lines"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        state["line_offsets"] = np.concatenate([[0], np.cumsum(np.array([len(e) for e in encoded], dtype=np.int64))])
+        buffer = io.BytesIO()
+        np.savez(buffer, **state)
+        with self._lock:
+            if generation != self._generation:
+                return  # El índice se vació mientras tanto
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write_bytes(self.path, buffer.getvalue())
+
+    def _load_state(self, state):
+        blob, offsets = state["lines"].tobytes(), state["line_offsets"]
+        self._lines = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+        self._message_index = _Growable(np.int64, data=state["message_index"])
+        if len(self._lines) != self._message_index.size:
+            raise ValueError("número de líneas inconsistente")
+
+    # Implementados por cada backend
+    def _prepare_query(self, query):
+        """Preprocesa la consulta fuera del lock (p. ej. llamadas de red)."""
+        return query
+
+    def _add(self, doc, line):
+        raise NotImplementedError
+
+    def _scores(self, query):
+        """Devuelve (documentos candidatos, puntuaciones) como arrays de NumPy."""
+        raise NotImplementedError
+
+    def _dump_state(self):
+        raise NotImplementedError
+
+
+class BM25Index(RetrievalIndex):
+    """BM25 sobre un índice invertido en arrays de NumPy; no necesita red.
+
+    Cada consulta solo recorre las listas de los términos de la consulta, por lo que el
+    coste depende de cuántos mensajes los contienen y no del tamaño del historial.
+    """
+    K1 = 1.2
+    B = 0.75
+    MAX_DF_RATIO = 0.5  # Términos presentes en más mensajes que esto apenas discriminan
+
+    def _clear(self):
+        super()._clear()
+        self._postings = {}  # término -> (documentos, frecuencias)
+        self._doc_len = _Growable(np.float32)
+        self._total_len = 0.0
+
+    def _add(self, doc, line):
+        terms = tokenize(line.split(":", 1)[-1])  # El rol no aporta al contenido
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (_Growable(np.int32), _Growable(np.float32))
+            postings[0].append(doc)
+            postings[1].append(tf)
+        self._doc_len.append(len(terms))
+        self._total_len += len(terms)
+
+    def _prepare_query(self, query):
+        return set(tokenize(query))
+
+    def _scores(self, terms):
+        n_docs = len(self._lines)
+        lists = []
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None or postings[0].size > max(1, self.MAX_DF_RATIO * n_docs):
+                continue
+            df = postings[0].size
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            lists.append((postings[0].view(), postings[1].view(), idf))
+        if not lists:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        docs = np.concatenate([d for d, _, _ in lists])
+        tf = np.concatenate([f for _, f, _ in lists])
+        idf = np.concatenate([np.full(len(d), w, dtype=np.float32) for d, _, w in lists])
+        avg_len = self._total_len / n_docs or 1.0
+        norm = self.K1 * (1 - self.B + self.B * self._doc_len.data[docs] / avg_len)
+        weights = idf * tf * (self.K1 + 1) / (tf + norm)
+
+        if len(lists) == 1:
+            return docs, weights
+        # Sumar las contribuciones de cada término por documento
+        totals = np.bincount(docs, weights=weights)
+        candidates = np.flatnonzero(totals)
+        return candidates, totals[candidates]
+
+    def _dump_state(self):
+        terms = list(self._postings)
+        sizes = np.array([self._postings[t][0].size for t in terms], dtype=np.int64)
+        return {
+            "terms": np.array(terms, dtype=str),
+            "offsets": np.concatenate([[0], np.cumsum(sizes)]),
+            "docs": np.concatenate([self._postings[t][0].view() for t in terms] or [np.empty(0, np.int32)]),
+            "tfs": np.concatenate([self._postings[t][1].view() for t in terms] or [np.empty(0, np.float32)]),
+            "doc_len": self._doc_len.view(),
+        }
+
+    def _load_state(self, state):
+        super()._load_state(state)
+        offsets, docs, tfs = state["offsets"], state["docs"], state["tfs"]
+        self._postings = {
+            str(term): (
+                _Growable(np.int32, data=docs[offsets[i]:offsets[i + 1]]),
+                _Growable(np.float32, data=tfs[offsets[i]:offsets[i + 1]]),
+            )
+            for i, term in enumerate(state["terms"])
+        }
+        self._doc_len = _Growable(np.float32, data=state["doc_len"])
+        self._total_len = float(self._doc_len.view().sum())
+        if self._doc_len.size != len(self._lines):
+            raise ValueError("longitudes inconsistentes")
+
+
+class EmbeddingIndex(RetrievalIndex):
+    """Similitud coseno sobre embeddings de Gemini (requiere red y API key).
+
+    Los mensajes se vectorizan por lotes en segundo plano; solo la consulta se
+    vectoriza durante el turno.
+    """
+    MODEL = "models/text-embedding-004"
+    BATCH = 64
+
+    def _clear(self):
+        super()._clear()
+        self._vectors = None  # Matriz (capacidad, dimensión) normalizada por filas
+        self._embedded = 0  # Documentos ya vectorizados (los siguientes están pendientes)
+        self._future = None
+
+    def _embed(self, content, task_type):
+        result = genai_module().embed_content(model=self.MODEL, content=content, task_type=task_type)
+        vectors = np.atleast_2d(np.asarray(result["embedding"], dtype=np.float32))
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def _add(self, doc, line):
+        if self._future is None or self._future.done():
+            self._future = _executor.submit(self._embed_pending)
+
+    def _embed_pending(self):
+        while True:
+            with self._lock:
+                generation, start = self._generation, self._embedded
+                batch = self._lines[start:start + self.BATCH]
+            if not batch:
+                return
+            try:
+                vectors = self._embed(batch, "retrieval_document")
+            except Exception as e:
+                # Se reintentará con el siguiente mensaje indexado
+                print(f"No se pudieron calcular los embeddings: {e}")
+                return
+
+            with self._lock:
+                if generation != self._generation:
+                    return
+                needed = start + len(vectors)
+                if self._vectors is None:
+                    self._vectors = np.empty((max(needed, 64), vectors.shape[1]), dtype=np.float32)
+                elif needed > len(self._vectors):
+                    self._vectors = np.resize(self._vectors, (max(needed, 2 * len(self._vectors)), vectors.shape[1]))
+                self._vectors[start:needed] = vectors
+                self._embedded = needed
+
+    def _prepare_query(self, query):
+        if not self._embedded or not query.strip():
+            return None
+        try:
+            return self._embed(query, "retrieval_query")[0]
+        except Exception as e:
+            print(f"No se pudo vectorizar la consulta: {e}")
+            return None
+
+    def _scores(self, query_vector):
+        if query_vector is None or not self._embedded:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.arange(self._embedded), self._vectors[:self._embedded] @ query_vector
+
+    def _dump_state(self):
+        dimension = 0 if self._vectors is None else self._vectors.shape[1]
+        vectors = self._vectors[:self._embedded] if self._embedded else np.empty((0, dimension), np.float32)
+        return {"vectors": vectors}
+
+    def _load_state(self, state):
+        super()._load_state(state)
+        vectors = state["vectors"]
+        self._vectors = np.array(vectors) if len(vectors) else None
+        self._embedded = len(vectors)
+        if self._embedded < len(self._lines):
+            self._future = _executor.submit(self._embed_pending)
+
+
+BACKENDS = {"bm25": BM25Index, "embedding": EmbeddingIndex}
+
+
+def create_index(path=None, backend=None):
+    """Índice del backend indicado (RETRIEVAL_BACKEND: bm25, embedding u off); None si está desactivado."""
+    backend = backend or os.getenv("RETRIEVAL_BACKEND", "bm25")
+    if backend == "off":
+        return None
+    return BACKENDS[backend](path)
@@ -0,0 +1,11 @@
+"""Configuración común: el genai falso de benchmarks/ se instala antes de importar el proyecto."""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import fake_genai  # noqa: E402
+
+fake_genai.install()
@@ -0,0 +1,124 @@
+"""Backend de sesión de chat nativa contra el genai falso de benchmarks/ (sin red ni API key)."""
+import pytest
+
+import fake_genai
+import model_client
+from character_base import CharacterAI
+from model_client import ModelError
+
+
+@pytest.fixture
+def character(monkeypatch):
+    monkeypatch.setattr(fake_genai.FakeConfig, "first_token_latency", 0)
+    monkeypatch.setattr(fake_genai.FakeConfig, "token_interval", 0)
+    monkeypatch.setattr(fake_genai.FakeConfig, "response_tokens", 5)
+    character = CharacterAI(
+        "Merlin", "Un mago sabio", "Hola viajero", model_name="fake-model",
+        backend=CharacterAI.BACKEND_CHAT,
+    )
+    character.load_history([{"role": "Merlin", "content": "Hola viajero"}])
+    return character
+
+
+def user_parts(chat):
+    return [part for turn in chat.history if turn["role"] == "user" for part in turn["parts"]]
+
+
+def test_session_recovers_after_stream_cut_mid_response(character, monkeypatch):
+    assert character.generate_response("hola")
+
+    # El stream se corta después de emitir fragmentos: la sesión nativa queda rota
+    monkeypatch.setattr(fake_genai.FakeConfig, "stream_failures", 1)
+    monkeypatch.setattr(fake_genai.FakeConfig, "stream_fail_after", 2)
+    with pytest.raises(ModelError):
+        list(character.generate_response_stream("cuéntame algo"))
+    assert [m.role for m in character.conversation_history] == ["Merlin", "Usuario", "Merlin"]
+
+    # Los turnos siguientes funcionan y el turno fallido no queda en la sesión
+    assert character.generate_response("sigue")
+    assert "".join(character.generate_response_stream("¿y ahora?"))
+    assert user_parts(character.chat) == [CharacterAI.CHAT_OPENING, "hola", "sigue", "¿y ahora?"]
+    assert len(character.conversation_history) == 7
+
+
+def test_greeting_is_kept_in_the_session_behind_an_opening_turn(character):
+    history = character._chat_history()
+    assert history[0] == {"role": "user", "parts": [CharacterAI.CHAT_OPENING]}
+    assert history[1] == {"role": "model", "parts": ["Hola viajero"]}
+
+
+def test_update_character_rebuilds_the_model_with_the_new_persona(character):
+    assert character.generate_response("hola")
+    character.update_character(personality="Un mago gruñón")
+
+    assert "Un mago gruñón" in character.model.system_instruction
+    assert character.chat.model is character.model
+    assert user_parts(character.chat) == [CharacterAI.CHAT_OPENING, "hola"]
+
+
+def test_retry_after_first_chunk_failure_uses_a_fresh_session(character, monkeypatch):
+    monkeypatch.setattr(fake_genai.FakeConfig, "stream_failures", 1)
+    monkeypatch.setattr(fake_genai.FakeConfig, "stream_fail_after", 0)
+    monkeypatch.setattr(character.client, "BASE_DELAY", 0)
+
+    # El primer intento falla dentro del cliente resiliente y el reintento debe poder enviar
+    assert "".join(character.generate_response_stream("hola"))
+    assert user_parts(character.chat) == [CharacterAI.CHAT_OPENING, "hola"]
+
+
+@pytest.fixture
+def long_persona(monkeypatch):
+    monkeypatch.setattr(fake_genai.FakeConfig, "first_token_latency", 0)
+    monkeypatch.setattr(fake_genai.FakeConfig, "token_interval", 0)
+    monkeypatch.setattr(fake_genai.FakeConfig, "response_tokens", 5)
+    monkeypatch.setattr(fake_genai.CachedContent, "created", [])
+    monkeypatch.setattr(model_client, "_context_caches", {})
+    # Por encima de CONTEXT_CACHE_MIN_TOKENS para que se use la caché de contexto
+    return "Un mago sabio que recuerda cada hechizo del reino. " * 400
+
+
+def cached_character(personality):
+    character = CharacterAI(
+        "Merlin", personality, "Hola viajero", model_name="fake-model",
+        backend=CharacterAI.BACKEND_CHAT, use_context_cache=True,
+    )
+    character.load_history([{"role": "Merlin", "content": "Hola viajero"}])
+    return character
+
+
+def age_context_caches(seconds):
+    for entry in model_client._context_caches.values():
+        entry[2] -= seconds
+
+
+def test_characters_with_the_same_persona_share_one_context_cache(long_persona):
+    first, second = cached_character(long_persona), cached_character(long_persona)
+    assert len(fake_genai.CachedContent.created) == 1
+    assert first.context_cache is second.context_cache
+    assert first.model is second.model
+
+
+def test_context_cache_ttl_is_renewed_before_it_expires(long_persona):
+    character = cached_character(long_persona)
+    cache, model = character.context_cache, character.model
+
+    age_context_caches(CharacterAI.CONTEXT_CACHE_TTL.total_seconds() * 0.75)
+    assert character.generate_response("hola")
+    assert cache.updates == 1 and not cache.deleted
+    assert character.model is model
+    assert len(fake_genai.CachedContent.created) == 1
+
+
+def test_expired_context_cache_is_replaced_and_the_session_rebuilt(long_persona):
+    character = cached_character(long_persona)
+    assert character.generate_response("hola")
+    old_cache, old_model = character.context_cache, character.model
+
+    age_context_caches(CharacterAI.CONTEXT_CACHE_TTL.total_seconds() * 2)
+    assert character.generate_response("sigue")
+    assert old_cache.deleted
+    assert len(fake_genai.CachedContent.created) == 2
+    assert character.context_cache is fake_genai.CachedContent.created[-1]
+    assert character.model is not old_model
+    # La sesión nueva conserva los turnos anteriores
+    assert user_parts(character.chat) == [CharacterAI.CHAT_OPENING, "hola", "sigue"]
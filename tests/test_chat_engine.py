@@ -0,0 +1,74 @@
+"""Persistencia de turnos del motor de chats (ChatEngine) con el genai falso."""
+import threading
+
+import pytest
+
+import fake_genai
+from chat_engine import ChatEngine, ChatNotFoundError
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(fake_genai.FakeConfig, "first_token_latency", 0.01)
+    monkeypatch.setattr(fake_genai.FakeConfig, "token_interval", 0.001)
+    engine = ChatEngine.open(tmp_path / "chats", tmp_path / "characters")
+    yield engine
+    engine.close()
+
+
+def stored_roles(engine, unique_id):
+    engine.writer.flush()
+    return [m["role"] for m in engine.store.load_chat(unique_id)["messages"]]
+
+
+def new_chat(engine):
+    return engine.start_chat(engine.new_character("Merlin", "Un mago sabio", "Hola viajero", model_name="fake-model"))
+
+
+def test_interrupted_stream_is_still_persisted(engine):
+    unique_id = new_chat(engine)
+    stream = engine.stream(unique_id, "hola")
+    next(stream)
+    stream.close()  # Como un rerun de Streamlit a mitad de la respuesta
+
+    engine.manager.submit_call(unique_id, lambda: None).result()  # Esperar a que acabe el turno
+    assert len(engine.get(unique_id).conversation_history) == 3
+    assert stored_roles(engine, unique_id) == ["Merlin", "user", "Merlin"]
+
+
+def test_concurrent_streams_on_one_chat_do_not_duplicate_rows(engine):
+    unique_id = new_chat(engine)
+    threads = [
+        threading.Thread(target=lambda m=m: "".join(engine.stream(unique_id, m)))
+        for m in ("uno", "dos", "tres")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stored_roles(engine, unique_id) == ["Merlin"] + ["user", "Merlin"] * 3
+
+
+def test_forced_save_during_a_stream_does_not_duplicate_the_turn(engine):
+    unique_id = new_chat(engine)
+    stream = engine.stream(unique_id, "hola")
+    next(stream)  # La respuesta sigue generándose en el pool
+    engine.save(unique_id)  # "Guardar Chat" mientras tanto
+    "".join(stream)
+
+    assert len(engine.get(unique_id).conversation_history) == 3
+    assert stored_roles(engine, unique_id) == ["Merlin", "user", "Merlin"]
+
+
+def test_deleted_chat_is_not_recreated_by_a_turn_in_flight(engine):
+    unique_id = new_chat(engine)
+    stream = engine.stream(unique_id, "hola")
+    next(stream)  # Otra pestaña borra el chat mientras la respuesta sigue generándose
+    engine.delete(unique_id)
+    "".join(stream)
+
+    engine.writer.flush()
+    assert engine.store.load_chat(unique_id) is None
+    with pytest.raises(ChatNotFoundError):
+        engine.submit(unique_id, "sigue")
@@ -0,0 +1,37 @@
+"""Lotes JSONL del modo headless con el genai falso."""
+import io
+import json
+
+import pytest
+
+import fake_genai
+import headless
+from chat_engine import ChatEngine
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(fake_genai.FakeConfig, "first_token_latency", 0)
+    monkeypatch.setattr(fake_genai.FakeConfig, "token_interval", 0)
+    engine = ChatEngine.open(tmp_path / "chats", tmp_path / "characters")
+    engine.registry.save({"name": "Merlin", "personality": "Un mago sabio", "greeting": "Hola", "unique_id": "merlin"})
+    yield engine
+    engine.close()
+
+
+def test_invalid_lines_are_reported_without_aborting_the_batch(engine):
+    lines = [
+        '{"id": 1, "unique_id": "eval-1", "character_id": "merlin", "message": "hola"}',
+        "5", "[1]", '"texto"', "no es json",
+        '{"unique_id": "eval-2", "character_id": {"a": 1}, "message": "x"}',
+        '{"unique_id": "no-existe", "message": "x"}',
+        '{"id": 2, "unique_id": "eval-1", "message": "¿y tú?"}',
+    ]
+    out = io.StringIO()
+
+    assert headless.run_batch(engine, lines, out) == {"ok": 2, "error": 6}
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r["line"] for r in results] == list(range(1, 9))
+    assert [r.get("id") for r in results if "response" in r] == [1, 2]
+    messages = engine.store.load_chat("eval-1")["messages"]
+    assert [m["content"] for m in messages if m["role"] == "user"] == ["hola", "¿y tú?"]
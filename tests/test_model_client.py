@@ -0,0 +1,76 @@
+"""Reintentos, conmutación de modelo y plazo total de ModelClient con operaciones falsas."""
+import time
+
+import pytest
+
+import model_client
+from model_client import ModelClient, ModelError, TokenBucket
+
+
+class StatusError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+@pytest.fixture(autouse=True)
+def breakers(monkeypatch):
+    monkeypatch.setattr(model_client, "_breakers", {})
+    return model_client._breakers
+
+
+def make_client(**kwargs):
+    client = ModelClient(["principal", "respaldo"], lambda name: name,
+                         rate_limiter=TokenBucket(1000), **kwargs)
+    client.BASE_DELAY = 0
+    return client
+
+
+class Operation:
+    """Lanza los errores indicados en orden y después responde con el modelo usado."""
+
+    def __init__(self, *errors, delay=0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, model, timeout):
+        self.calls.append((model, timeout))
+        time.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"respuesta de {model}"
+
+
+def test_retryable_error_is_retried_then_succeeds(breakers):
+    client = make_client()
+    operation = Operation(StatusError(503), TimeoutError())
+
+    assert client.call(operation) == "respuesta de principal"
+    assert [model for model, _ in operation.calls] == ["principal"] * 3
+    assert client.last_model_name == "principal"
+    assert breakers["principal"].state == "closed"
+
+
+def test_non_retryable_error_fails_over_without_counting_for_the_breaker(monkeypatch):
+    failures = []
+    monkeypatch.setattr(model_client.CircuitBreaker, "record_failure", lambda breaker: failures.append(breaker))
+    client = make_client()
+    operation = Operation(StatusError(400))
+
+    assert client.call(operation) == "respuesta de respaldo"
+    assert [model for model, _ in operation.calls] == ["principal", "respaldo"]
+    assert client.last_model_name == "respaldo"
+    assert failures == []
+
+
+def test_deadline_bounds_the_whole_call_including_retries():
+    client = make_client(deadline=0.3, max_retries=10)
+    operation = Operation(*[TimeoutError()] * 10, delay=0.1)
+
+    start = time.monotonic()
+    with pytest.raises(ModelError, match="Plazo agotado"):
+        client.call(operation)
+    assert time.monotonic() - start < 0.6
+    # Cada llamada recibe como timeout lo que queda del plazo
+    assert all(timeout <= 0.3 for _, timeout in operation.calls)
@@ -0,0 +1,41 @@
+"""Claves de la caché de respuestas frente al contexto que se inyecta en el prompt."""
+import pytest
+
+import fake_genai
+from character_base import CharacterAI
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(fake_genai.FakeConfig, "first_token_latency", 0)
+    monkeypatch.setattr(fake_genai.FakeConfig, "token_interval", 0)
+    return ResponseCache()
+
+
+def make_character(cache, summary=""):
+    character = CharacterAI(
+        "Merlin", "Un mago sabio", "Hola viajero", model_name="fake-model",
+        backend=CharacterAI.BACKEND_PROMPT, response_cache=cache,
+    )
+    character.load_history([{"role": "Merlin", "content": "Hola viajero"}], summary=summary)
+    return character
+
+
+def test_same_context_is_served_from_cache(cache):
+    make_character(cache).generate_response("¿Quién eres?")
+    make_character(cache).generate_response("quien eres")
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_summary_of_another_chat_is_not_served(cache):
+    make_character(cache, summary="El usuario se llama Ana y vive en Sevilla.").generate_response("¿Quién soy?")
+    make_character(cache).generate_response("¿Quién soy?")
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_recalled_lines_are_part_of_the_key(cache):
+    first, second = make_character(cache), make_character(cache)
+    key = cache.make_key(first, first.conversation_history, "hola")
+    assert cache.make_key(second, second.conversation_history, "hola") == key
+    assert cache.make_key(second, second.conversation_history, "hola", recalled=["Usuario: soy Ana"]) != key
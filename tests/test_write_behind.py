@@ -0,0 +1,62 @@
+"""Escritura diferida frente a operaciones que fallan al llegar al almacén."""
+import time
+
+import pytest
+
+from chat_store import ChatStore
+from persistence import WriteBehindQueue
+
+DATA = {"name": "Merlin", "personality": "Un mago sabio", "greeting": "Hola viajero"}
+
+
+class FailingStore(ChatStore):
+    """ChatStore cuyas escrituras fallan siempre para los chats de broken."""
+
+    def __init__(self, db_path, broken):
+        super().__init__(db_path)
+        self.broken = set(broken)
+        self.failures = 0
+
+    def write_batch(self, operations):
+        if any(chat_id in self.broken for _, chat_id, _, _ in operations):
+            self.failures += 1
+            raise OSError("disco no disponible")
+        super().write_batch(operations)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = FailingStore(tmp_path / "chats.db", broken={"roto"})
+    yield store
+    store.close()
+
+
+def message(content):
+    return {"role": "user", "content": content}
+
+
+def test_failing_operation_does_not_block_the_rest_of_the_batch(store):
+    writer = WriteBehindQueue(store, flush_interval=0.01)
+    writer.save_chat("bueno", DATA, [message("hola")])
+    writer.save_chat("roto", DATA, [message("hola")])
+    writer.append_messages("bueno", [message("sigue")])
+
+    # El chat roto se descarta tras MAX_RETRIES reintentos y flush() termina
+    assert writer.flush(timeout=5)
+    assert [m["content"] for m in store.load_chat("bueno")["messages"]] == ["hola", "sigue"]
+    assert store.load_chat("roto") is None
+    assert isinstance(writer.last_error, OSError)
+    writer.close()
+
+
+def test_operation_that_recovers_is_written_on_retry(store):
+    writer = WriteBehindQueue(store, flush_interval=0.01)
+    writer.save_chat("roto", DATA, [message("hola")])
+    while not store.failures:  # Esperar al primer intento fallido
+        time.sleep(0.001)
+    store.broken.clear()
+
+    assert writer.flush(timeout=5)
+    assert store.load_chat("roto") is not None
+    assert writer.last_error is None
+    writer.close()